@@ -1,7 +1,7 @@
 import pytest
 from aocd.models import Puzzle
 from typing import Iterator
-from functools import cache
+from collections import OrderedDict
 
 EMPTY = 0
 SPRING = 1
@@ -21,74 +21,116 @@ def part1(lines: list[tuple[tuple[int, ...], tuple[int, ...]]]) -> int:
 
 
 
-def arrangements(springs: tuple[int, ...], expected_groups: tuple[int, ...]) -> int:
+class ArrangementMemo:
+    """
+    Size bounded LRU memo for arrangement counts, shared between lines.
+
+    Entries are keyed on the canonical (remaining springs, remaining groups) state,
+    so identical subproblems of different lines (or of the repeated copies in part 2)
+    are only computed once. The least recently used entry is evicted once more than
+    `maxsize` entries are stored.
+    """
+
+    def __init__(self, maxsize: int = 1_000_000):
+        self.maxsize = maxsize
+        self._entries: OrderedDict[tuple[tuple[int, ...], tuple[int, ...]], int] = (
+            OrderedDict()
+        )
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: tuple[tuple[int, ...], tuple[int, ...]]) -> int | None:
+        value = self._entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: tuple[tuple[int, ...], tuple[int, ...]], value: int):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def clear(self):
+        self._entries.clear()
+        self.hits = self.misses = self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+MEMO = ArrangementMemo()
+
+
+def arrangements(
+    springs: tuple[int, ...],
+    expected_groups: tuple[int, ...],
+    memo: ArrangementMemo = MEMO,
+) -> int:
     """
     Calculate the number of possible arrangments of UNKNOWN springs to end up with
     the expected groups.
+
+    Subproblems are stored in `memo`, which by default is shared across all calls.
     """
-    @cache  # <-- dynamic programming :D
-    def _arrangements(groups: tuple[int, ...], springs: tuple[int, ...], last_was_zero: bool = True) -> int:
-        """
-        Calcualte number of possible arrangments
+    return _arrangements(springs, expected_groups, memo)
 
-        Scans the springs from left to right and stores the current groups. As new 
-        springs are processed the current groups are updated.
 
-        If an unkown spring is encountered recursively calls itself with both
-        possibilities.
+def _arrangements(
+    springs: tuple[int, ...], groups: tuple[int, ...], memo: ArrangementMemo
+) -> int:
+    """
+    Calculate number of possible arrangements by placing one group at a time.
 
-        Args:
-            groups: The groups we have computed so far
-            springs: The springs left to process in the line
-            last_was_zero: Flag indicating whether the last processed symbol
-                in our line was zero or not.
-                Decides whether a new spring will be the first of a new group
-                or added to the last existing group.
-        """
-        already_final = groups[:-1]  # early stopping
-        if already_final != expected_groups[:len(already_final)]:
-            return 0
-
-        try:
-            index = springs.index(UNKNOWN)
-        except ValueError:  # no more unknowns
-            groups, _ = combine(groups, springs, last_was_zero)
-            return 1 if groups == expected_groups else 0
-        
-        # fast forward to the next UNKNOWN, and then calculate both options
-        groups, last_was_zero = combine(groups, springs[:index], last_was_zero)
-        remaining = springs[index+1:]
-
-        groups_a, was_zero_a = combine(groups, (0,), last_was_zero)
-        groups_b, was_zero_b = combine(groups, (1,), last_was_zero)
-
-        return _arrangements(groups_a, remaining, was_zero_a) + _arrangements(groups_b, remaining, was_zero_b)
-
-    return _arrangements((), springs, True)
-
-def combine(groups: tuple[int, ...], springs: tuple[int, ...], new_group: bool = True):
-    if not springs:
-        return groups, new_group
-
-    if new_group:
-        existing = list(groups)
-        count = 0
-    else:
-        existing = list(groups[:-1])
-        count = groups[-1]
-
-    for spring in springs:
-        if spring > 0:
-            count += spring
-        elif count > 0:
-            existing.append(count)
-            count = 0
-    
-    if count > 0:
-        existing.append(count)
-    
-    return tuple(existing), springs[-1] == EMPTY  # if we ended with EMPTY, start a new group
+    Leading EMPTY springs are dropped first, so the state only consists of the
+    springs left to process and the groups left to place. If the next spring is
+    UNKNOWN, we either treat it as EMPTY, or place the next group starting at it.
+
+    Args:
+        springs: The springs left to process in the line
+        groups: The groups that still have to be placed in those springs
+        memo: Memo for already computed (springs, groups) states
+    """
+    start = 0
+    while start < len(springs) and springs[start] == EMPTY:
+        start += 1
+    springs = springs[start:]
+
+    if not groups:
+        return 0 if SPRING in springs else 1
 
+    # early stopping: not enough springs left to fit all groups with gaps in between
+    if len(springs) < sum(groups) + len(groups) - 1:
+        return 0
+
+    key = (springs, groups)
+    cached = memo.get(key)
+    if cached is not None:
+        return cached
+
+    count = 0
+    if springs[0] == UNKNOWN:  # treat it as EMPTY
+        count += _arrangements(springs[1:], groups, memo)
+
+    # treat it as SPRING, so the next group starts here and needs a gap afterwards
+    size = groups[0]
+    fits = EMPTY not in springs[:size]
+    if fits and (len(springs) == size or springs[size] != SPRING):
+        count += _arrangements(springs[size + 1 :], groups[1:], memo)
+
+    memo.put(key, count)
+    return count
 
 
 def part2(lines: list[tuple[tuple[int, ...], tuple[int, ...]]]) -> int:
@@ -120,24 +162,6 @@ def example_input():
     )
 
 
-def test_combine():
-    assert combine((), (1, 0, 1, 0, 1, 1, 1))[0] == (1, 1, 3)
-    assert combine((), (1, 0, 1, 0, 3))[0] == (1, 1, 3)
-    assert combine((), (0, 1, 1, 0, 0, 1, 1))[0] == (2, 2)
-    assert combine((), (0, 1, 1, 0, 0, 1, 1, 0, 0))[0] == (2, 2)
-
-    assert combine((2, 2,), (0, 1, 1, 0, 0, 1, 1, 0, 0))[0] == (2, 2, 2, 2)
-    assert combine((2, 1,), (1, 0, 1, 1, 0, 0, 1, 1, 0, 0), True)[0] == (2, 1, 1, 2, 2)
-    assert combine((2, 1,), (1, 0, 1, 1, 0, 0, 1, 1, 0, 0), False)[0] == (2, 2, 2, 2)
-    assert combine((3,), (1, 0, 1), False)[0] == (4, 1)
-
-    groups, new_group = (), True
-    for x in [1, 0, 1, 0, 1, 1, 1]:
-        groups, new_group = combine(groups, (x,), new_group)
-    
-    assert groups == (1, 1, 3)
-
-
 def test_part1(puzzle_input):
     assert part1(puzzle_input) == 7506
 
@@ -159,3 +183,16 @@ def test_single_example_part2():
 
 def test_example_part2(example_input):
     assert part2(example_input) == 525152
+
+
+def test_shared_memo(example_input):
+    memo = ArrangementMemo()
+    counts = [arrangements(springs, groups, memo) for springs, groups in example_input]
+    assert counts == [1, 4, 1, 1, 4, 10]
+    assert memo.hits > 0
+
+    # a tiny memo evicts constantly, but still gives the same results
+    tiny = ArrangementMemo(maxsize=2)
+    assert [arrangements(s, g, tiny) for s, g in example_input] == counts
+    assert tiny.evictions > 0
+    assert len(tiny) <= 2
@@ -9,32 +9,54 @@ def parse(data: str) -> list[np.ndarray]:
 
 
 def part1(patterns: list[np.ndarray]) -> int:
-    return sum(find_reflection(pattern) for pattern in patterns)
+    return _total_score(reflection_scores(patterns, max_smudge=0)[0])
 
 
 def find_reflection(pattern: np.ndarray, smudge: int = 0) -> int:
-    column = find_vertical_line_reflection(pattern, smudge)
+    rows, columns = encode(pattern)
+    column = find_line_reflection(columns, smudge)
     if column:
         return column
 
-    row = find_vertical_line_reflection(pattern.T, smudge)
+    row = find_line_reflection(rows, smudge)
     if row:
         return row * 100
 
     raise ValueError("No reflection found")
 
 
+def encode(pattern: np.ndarray) -> tuple[list[int], list[int]]:
+    """
+    Encode every row and every column of the pattern as an integer bitmask,
+    with a set bit for every # in it.
+    """
+    return _encode_lines(pattern), _encode_lines(pattern.T)
+
+
+def _encode_lines(pattern: np.ndarray) -> list[int]:
+    """Encode every row of the pattern as an integer bitmask"""
+    bits = np.where(pattern == "#", "1", "0")
+    return [int("".join(line), 2) for line in bits]
+
+
 def find_vertical_line_reflection(pattern: np.ndarray, smudge: int = 0) -> int | None:
-    for i in range(1, pattern.shape[1]):  # try all possible columns as reflection line
-        left = pattern[:, :i]
-        right = pattern[:, i:]
-        left = left[:, ::-1]  # mirror left side
-        # now make sure both sides have the same width
-        cropped_width = min(left.shape[1], right.shape[1])
-        left = left[:, :cropped_width]
-        right = right[:, :cropped_width]
-
-        unequal = (left != right).sum()  # check how many pixels are different
+    return find_line_reflection(_encode_lines(pattern.T), smudge)
+
+
+def find_line_reflection(lines: list[int], smudge: int = 0) -> int | None:
+    """
+    Find a reflection line between two of the given encoded lines (rows or columns)
+
+    Each mirrored pair of lines is compared by counting the set bits of their XOR,
+    which is the number of different pixels between them.
+    """
+    for i in range(1, len(lines)):  # try all possible lines as reflection line
+        unequal = 0
+        for offset in range(min(i, len(lines) - i)):
+            unequal += (lines[i - 1 - offset] ^ lines[i + offset]).bit_count()
+            if unequal > smudge:  # already too many differences, no need to go on
+                break
+
         if unequal == smudge:  # if that equals the smudge, we found a reflection
             return i
 
@@ -42,7 +64,76 @@ def find_vertical_line_reflection(pattern: np.ndarray, smudge: int = 0) -> int |
 
 
 def part2(patterns: list[np.ndarray]) -> int:
-    return sum(find_reflection(pattern, smudge=1) for pattern in patterns)
+    return _total_score(reflection_scores(patterns, max_smudge=1)[1])
+
+
+def _total_score(scores: np.ndarray) -> int:
+    if (scores == 0).any():
+        raise ValueError("No reflection found")
+    return int(scores.sum())
+
+
+def reflection_scores(patterns: list[np.ndarray], max_smudge: int = 1) -> np.ndarray:
+    """
+    Find the reflections of all patterns at once, for every smudge from 0 to
+    max_smudge.
+
+    All patterns are padded into one (pattern, row, column) uint8 tensor, and the
+    number of different pixels for every candidate reflection line of every pattern
+    is computed with a few array operations per mirror offset.
+
+    Returns:
+        Array of shape (max_smudge + 1, len(patterns)), with the score of each
+        pattern (columns left of the line, or 100 * rows above it) per smudge, or 0
+        if a pattern has no reflection with that smudge.
+    """
+    heights = np.array([pattern.shape[0] for pattern in patterns])
+    widths = np.array([pattern.shape[1] for pattern in patterns])
+    tensor = np.zeros((len(patterns), heights.max(), widths.max()), dtype=np.uint8)
+    for i, pattern in enumerate(patterns):
+        tensor[i, : pattern.shape[0], : pattern.shape[1]] = pattern == "#"
+
+    column_mismatches = _line_mismatches(tensor, widths)
+    row_mismatches = _line_mismatches(tensor.transpose(0, 2, 1), heights)
+
+    scores = np.zeros((max_smudge + 1, len(patterns)), dtype=int)
+    for smudge in range(max_smudge + 1):
+        columns = _first_line(column_mismatches == smudge)
+        rows = _first_line(row_mismatches == smudge)
+        scores[smudge] = np.where(columns > 0, columns, rows * 100)
+
+    return scores
+
+
+def _line_mismatches(tensor: np.ndarray, widths: np.ndarray) -> np.ndarray:
+    """
+    Count the different pixels for every vertical reflection line of every pattern.
+
+    Entry [n, i] is the count for pattern n mirrored between column i - 1 and i.
+    Lines that are not inside a pattern (i == 0 or i >= width) are set to -1.
+    """
+    n_patterns, _, width = tensor.shape
+    lines = np.arange(width)
+    mismatches = np.zeros((n_patterns, width), dtype=np.int32)
+
+    for offset in range(width // 2):
+        # all lines that still have a column pair at this distance in the tensor
+        candidates = lines[offset + 1 : width - offset]
+        left = tensor[:, :, candidates - 1 - offset]
+        right = tensor[:, :, candidates + offset]
+        unequal = (left != right).sum(axis=1, dtype=np.int32)
+        # ignore pairs where the right column is part of the padding
+        inside = candidates[None, :] + offset < widths[:, None]
+        mismatches[:, candidates] += unequal * inside
+
+    mismatches[:, 0] = -1
+    mismatches[lines[None, :] >= widths[:, None]] = -1
+    return mismatches
+
+
+def _first_line(is_reflection: np.ndarray) -> np.ndarray:
+    """Index of the first reflection line per pattern, or 0 if there is none"""
+    return np.where(is_reflection.any(axis=1), is_reflection.argmax(axis=1), 0)
 
 
 @pytest.fixture()
@@ -87,3 +178,30 @@ def test_part2(puzzle_input):
 
 def test_example_part2(example_input):
     assert part2(example_input) == 400
+
+
+def test_encode(example_input):
+    rows, columns = encode(example_input[0])
+    assert rows[0] == 0b101100110
+    assert columns[0] == 0b1011001
+    assert find_line_reflection(columns) == 5
+    assert find_line_reflection(rows, smudge=1) == 3
+    assert find_vertical_line_reflection(example_input[0]) == 5
+    assert find_vertical_line_reflection(example_input[1].T, smudge=1) == 1
+
+
+def test_reflection_scores(example_input):
+    scores = reflection_scores(example_input, max_smudge=1)
+    assert scores.tolist() == [[5, 400], [300, 100]]
+    assert scores.tolist() == [
+        [find_reflection(pattern, smudge) for pattern in example_input]
+        for smudge in (0, 1)
+    ]
+
+    # only reflects with a smudge, which must not affect the other pattern
+    smudged = parse("#.\n..")[0]
+    scores = reflection_scores([example_input[0], smudged], max_smudge=1)
+    assert scores.tolist() == [[5, 0], [300, 1]]
+    assert part2([smudged]) == 1
+    with pytest.raises(ValueError):
+        part1([smudged])
@@ -2,6 +2,7 @@ from typing import Callable
 import pytest
 from aocd.models import Puzzle
 import numpy as np
+from numba import jit
 
 
 NORTH = (
@@ -41,9 +42,8 @@ def coords(platform: np.ndarray) -> tuple[set[complex], set[complex]]:
 
 
 def part1(platform: np.ndarray) -> int:
-    round_rocks, cube_rocks = coords(platform)
-    round_rocks = tilt(round_rocks, cube_rocks, NORTH)
-    return calc_load(round_rocks)
+    engine = TiltEngine(platform)
+    return engine.load(engine.tilt(platform == "O", NORTH))
 
 
 def tilt(
@@ -74,21 +74,181 @@ def calc_load(rocks: set[complex]) -> int:
     return int(sum(rock.real for rock in rocks))
 
 
-def part2(platform: np.ndarray) -> int:
-    round_rocks, cube_rocks = coords(platform)
-
-    cycle_start, cycle_length = find_cycle(round_rocks, cube_rocks)
-
-    for _ in range(cycle_start):
-        round_rocks = cycle(round_rocks, cube_rocks)
-
-    remaining = 1000000000 - cycle_start
-    remaining %= cycle_length
-
-    for _ in range(remaining):
-        round_rocks = cycle(round_rocks, cube_rocks)
-
-    return calc_load(round_rocks)
+def _oriented(grid: np.ndarray, direction_vector: complex) -> np.ndarray:
+    """View of the grid in which rocks roll towards index 0 along axis 0"""
+    if direction_vector == NORTH[0]:
+        return grid
+    if direction_vector == SOUTH[0]:
+        return grid[::-1]
+    if direction_vector == WEST[0]:
+        return grid.T
+    if direction_vector == EAST[0]:
+        return grid[:, ::-1].T
+    raise ValueError(f"Unknown direction {direction_vector}")
+
+
+class TiltEngine:
+    """
+    Tilts a platform, with round rocks given as a boolean mask of the platform.
+
+    For every direction, the rows/columns of the platform are split into segments
+    between cube rocks once. Every cell then knows its segment and its rank in that
+    segment, counted from the wall the rocks roll towards. A tilt is just counting
+    the round rocks per segment and marking the first `count` cells of each segment,
+    so it costs O(cells) regardless of how far the rocks roll.
+    """
+
+    def __init__(self, platform: np.ndarray):
+        self.cubes = platform == "#"
+        self.height, self.width = platform.shape
+        # load of a single round rock in each row, the southmost row has load 1
+        self.row_loads = np.arange(self.height, 0, -1)
+        self._segments = {
+            direction[0]: self._segments_for(direction[0])
+            for direction in (NORTH, WEST, SOUTH, EAST)
+        }
+
+    def _segments_for(
+        self, direction_vector: complex
+    ) -> tuple[np.ndarray, np.ndarray, int]:
+        cubes = _oriented(self.cubes, direction_vector)
+        length, lines = cubes.shape
+        positions = np.arange(length)[:, None]
+
+        # position of the last cube rock before (or at) each cell, -1 for the wall
+        last_cube = np.maximum.accumulate(np.where(cubes, positions, -1), axis=0)
+        ranks = positions - last_cube - 1
+        ranks[cubes] = cubes.size  # cube rocks never hold a round rock
+        # every cube rock starts a new segment, numbered separately for each line
+        segments = np.cumsum(cubes, axis=0) + np.arange(lines) * (length + 1)
+
+        # store them in the layout of the platform, so they can be indexed directly
+        platform_segments = np.empty(self.cubes.shape, dtype=np.intp)
+        platform_ranks = np.empty(self.cubes.shape, dtype=np.intp)
+        _oriented(platform_segments, direction_vector)[...] = segments
+        _oriented(platform_ranks, direction_vector)[...] = ranks
+
+        return platform_segments.ravel(), platform_ranks.ravel(), lines * (length + 1)
+
+    def tilt(
+        self,
+        round_rocks: np.ndarray,
+        direction: tuple[complex, Callable[[set[complex]], list[complex]]],
+    ) -> np.ndarray:
+        segments, ranks, n_segments = self._segments[direction[0]]
+        counts = np.bincount(segments[round_rocks.ravel()], minlength=n_segments)
+        return (ranks < counts[segments]).reshape(round_rocks.shape)
+
+    def cycle(self, round_rocks: np.ndarray) -> np.ndarray:
+        round_rocks = self.tilt(round_rocks, NORTH)
+        round_rocks = self.tilt(round_rocks, WEST)
+        round_rocks = self.tilt(round_rocks, SOUTH)
+        round_rocks = self.tilt(round_rocks, EAST)
+        return round_rocks
+
+    def load(self, round_rocks: np.ndarray) -> int:
+        return int(round_rocks.sum(axis=1) @ self.row_loads)
+
+
+EMPTY = 0
+ROUND = 1
+CUBE = 2
+
+
+@jit(nopython=True)
+def _tilt_columns(grid: np.ndarray, free: np.ndarray):
+    """Roll all round rocks towards row 0 of the grid (view), in place"""
+    height, width = grid.shape
+    free[:] = 0  # first free row in each column
+    for y in range(height):
+        for x in range(width):
+            cell = grid[y, x]
+            if cell == CUBE:
+                free[x] = y + 1
+            elif cell == ROUND:
+                if free[x] != y:
+                    grid[free[x], x] = ROUND
+                    grid[y, x] = EMPTY
+                free[x] += 1
+
+
+@jit(nopython=True)
+def _tilt_rows(grid: np.ndarray):
+    """Roll all round rocks towards column 0 of the grid (view), in place"""
+    height, width = grid.shape
+    for y in range(height):
+        free = 0  # first free column in this row
+        for x in range(width):
+            cell = grid[y, x]
+            if cell == CUBE:
+                free = x + 1
+            elif cell == ROUND:
+                if free != x:
+                    grid[y, free] = ROUND
+                    grid[y, x] = EMPTY
+                free += 1
+
+
+@jit(nopython=True)
+def _grid_load(grid: np.ndarray) -> int:
+    height, width = grid.shape
+    load = 0
+    for y in range(height):
+        for x in range(width):
+            if grid[y, x] == ROUND:
+                load += height - y
+    return load
+
+
+class PlatformSimulator:
+    """
+    Simulates a platform in place, for platforms too large for the other approaches.
+
+    The whole platform is kept in a single uint8 grid of EMPTY, ROUND and CUBE
+    cells. Every direction is a (strided) view of that grid, in which the rocks roll
+    towards index 0, so tilting never allocates any memory. North/south tilts run row
+    by row over all columns at once, to walk the grid in memory order.
+    """
+
+    def __init__(self, platform: np.ndarray):
+        self.grid = np.full(platform.shape, EMPTY, dtype=np.uint8)
+        self.grid[platform == "O"] = ROUND
+        self.grid[platform == "#"] = CUBE
+
+        self._free = np.zeros(platform.shape[1], dtype=np.intp)
+        # (view of the grid, whether the rocks roll along the columns of the view)
+        self._views = {
+            NORTH[0]: (self.grid, True),
+            SOUTH[0]: (self.grid[::-1], True),
+            WEST[0]: (self.grid, False),
+            EAST[0]: (self.grid[:, ::-1], False),
+        }
+
+    def tilt(self, direction: tuple[complex, Callable[[set[complex]], list[complex]]]):
+        view, along_columns = self._views[direction[0]]
+        if along_columns:
+            _tilt_columns(view, self._free)
+        else:
+            _tilt_rows(view)
+
+    def cycle(self):
+        self.tilt(NORTH)
+        self.tilt(WEST)
+        self.tilt(SOUTH)
+        self.tilt(EAST)
+
+    def load(self) -> int:
+        return _grid_load(self.grid)
+
+    @property
+    def round_rocks(self) -> np.ndarray:
+        return self.grid == ROUND
+
+
+def part2(platform: np.ndarray, spin_cycles: int = 1000000000) -> int:
+    engine = TiltEngine(platform)
+    cycle_start, cycle_length, loads = find_cycle(engine, platform == "O")
+    return load_after(spin_cycles, cycle_start, cycle_length, loads)
 
 
 def cycle(round_rocks: set[complex], cube_rocks: set[complex]) -> set[complex]:
@@ -99,24 +259,48 @@ def cycle(round_rocks: set[complex], cube_rocks: set[complex]) -> set[complex]:
     return round_rocks
 
 
-def find_cycle(round_rocks: set[complex], cube_rocks: set[complex]) -> tuple[int, int]:
+def find_cycle(
+    engine: TiltEngine, round_rocks: np.ndarray
+) -> tuple[int, int, list[int]]:
+    """
+    Spin the platform until a state repeats.
+
+    States are stored bit-packed (one bit per cell) and matched exactly, and the
+    load of every state is recorded along the way.
+
+    Returns:
+        The cycle start, the cycle length and the load after each number of spin
+        cycles up to the repeated state (exclusive)
+    """
     cycles = 0
-    seen_states: dict[int, int] = {rock_hash(round_rocks): cycles}
+    seen_states: dict[bytes, int] = {pack_state(round_rocks): cycles}
+    loads = [engine.load(round_rocks)]
     while True:
-        round_rocks = cycle(round_rocks, cube_rocks)
+        round_rocks = engine.cycle(round_rocks)
         cycles += 1
 
-        current_hash = rock_hash(round_rocks)
-        if current_hash in seen_states:
-            cycle_start = seen_states[current_hash]
+        state = pack_state(round_rocks)
+        if state in seen_states:
+            cycle_start = seen_states[state]
             cycle_length = cycles - cycle_start
-            return cycle_start, cycle_length
+            return cycle_start, cycle_length, loads
+
+        seen_states[state] = cycles
+        loads.append(engine.load(round_rocks))
+
+
+def pack_state(rocks: np.ndarray) -> bytes:
+    return np.packbits(rocks).tobytes()
 
-        seen_states[current_hash] = cycles
 
+def load_after(
+    spin_cycles: int, cycle_start: int, cycle_length: int, loads: list[int]
+) -> int:
+    """Load after the given number of spin cycles, using the results of find_cycle"""
+    if spin_cycles < cycle_start:
+        return loads[spin_cycles]
 
-def rock_hash(rocks: set[complex]) -> int:
-    return hash(tuple((int(rock.real), int(rock.imag)) for rock in rocks))
+    return loads[cycle_start + (spin_cycles - cycle_start) % cycle_length]
 
 
 @pytest.fixture()
@@ -156,3 +340,52 @@ def test_part2(puzzle_input):
 
 def test_example_part2(example_input):
     assert part2(example_input) == 64
+
+
+def test_tilt_engine(example_input):
+    engine = TiltEngine(example_input)
+    round_rocks, cube_rocks = coords(example_input)
+
+    def to_coords(rocks: np.ndarray) -> set[complex]:
+        platform = np.where(rocks, "O", np.where(engine.cubes, "#", "."))
+        return coords(platform)[0]
+
+    for direction in (NORTH, WEST, SOUTH, EAST):
+        expected = tilt(round_rocks, cube_rocks, direction)
+        assert to_coords(engine.tilt(example_input == "O", direction)) == expected
+
+    rocks = example_input == "O"
+    for _ in range(3):
+        rocks = engine.cycle(rocks)
+        round_rocks = cycle(round_rocks, cube_rocks)
+        assert to_coords(rocks) == round_rocks
+        assert engine.load(rocks) == calc_load(round_rocks)
+
+
+def test_find_cycle(example_input):
+    engine = TiltEngine(example_input)
+    cycle_start, cycle_length, loads = find_cycle(engine, example_input == "O")
+    assert (cycle_start, cycle_length) == (3, 7)
+    assert len(loads) == cycle_start + cycle_length
+
+    rocks = example_input == "O"
+    for spin_cycles in range(25):
+        load = load_after(spin_cycles, cycle_start, cycle_length, loads)
+        assert load == engine.load(rocks)
+        rocks = engine.cycle(rocks)
+
+
+def test_platform_simulator(example_input):
+    engine = TiltEngine(example_input)
+    simulator = PlatformSimulator(example_input)
+
+    simulator.tilt(NORTH)
+    assert simulator.load() == part1(example_input)
+
+    simulator = PlatformSimulator(example_input)
+    rocks = example_input == "O"
+    for _ in range(5):
+        simulator.cycle()
+        rocks = engine.cycle(rocks)
+        assert (simulator.round_rocks == rocks).all()
+        assert simulator.load() == engine.load(rocks)
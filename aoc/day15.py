@@ -1,18 +1,34 @@
 from collections import defaultdict
-from functools import cache
+from collections.abc import Iterator
+from functools import lru_cache
+import mmap
+import os
+from typing import BinaryIO
 import pytest
 from aocd.models import Puzzle
+import numpy as np
+from numba import jit
 
 
 def parse(data: str) -> list[str]:
     return data.strip().split(",")
 
 
-def part1(lens: list[str]) -> int:
-    return sum(calc_hash(l) for l in lens)
+def part1(lens: list[str] | str | bytes) -> int:
+    """
+    Sum of the HASH of all steps. The raw input is hashed as is, a list of already
+    split steps has to be joined back together first.
+    """
+    if isinstance(lens, bytes):
+        data = lens
+    elif isinstance(lens, str):
+        data = lens.encode()
+    else:
+        data = ",".join(lens).encode()
+    return int(hash_steps(data).sum(dtype=np.int64))
 
 
-@cache
+@lru_cache(maxsize=65536)
 def calc_hash(s: str) -> int:
     value = 0
     for ch in s:
@@ -22,6 +38,28 @@ def calc_hash(s: str) -> int:
     return value
 
 
+def hash_steps(data: bytes) -> np.ndarray:
+    """HASH of every comma separated step in the raw input, computed in bulk"""
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    hashes = np.zeros(np.count_nonzero(buffer == ord(",")) + 1, dtype=np.uint8)
+    _hash_steps(buffer, hashes)
+    return hashes
+
+
+@jit(nopython=True)
+def _hash_steps(buffer: np.ndarray, hashes: np.ndarray):
+    step = 0
+    value = 0
+    for ch in buffer:
+        if ch == 44:  # ord(","), next step
+            hashes[step] = value
+            step += 1
+            value = 0
+        elif ch != 10:  # ord("\n"), newlines are ignored
+            value = (value + ch) * 17 % 256
+    hashes[step] = value
+
+
 def part2(lenses) -> int:
     # fortunately, python dicts preserve insertion order
     # so, let's use a hashmap to implement a hashmap
@@ -46,6 +84,187 @@ def calc_focusing_power(boxes: dict[int, dict[str, int]]) -> int:
     return focusing_power
 
 
+class _FenwickTree:
+    """Prefix sums over a growing list of values, with O(log n) updates and queries"""
+
+    def __init__(self):
+        self.tree = [0]  # 1-based, index 0 is unused
+
+    def __len__(self) -> int:
+        return len(self.tree) - 1
+
+    def append(self, value: int) -> int:
+        index = len(self.tree)
+        # the new node holds the sum of the values in (index - lowbit, index]
+        lowbit = index & -index
+        self.tree.append(value + self.prefix(index - 1) - self.prefix(index - lowbit))
+        return index
+
+    def add(self, index: int, delta: int):
+        while index < len(self.tree):
+            self.tree[index] += delta
+            index += index & -index
+
+    def prefix(self, index: int) -> int:
+        total = 0
+        while index > 0:
+            total += self.tree[index]
+            index -= index & -index
+        return total
+
+
+class _Box:
+    """
+    Lenses of a single box, with the focusing power of the box kept up to date.
+
+    Every lens gets an order index when it is inserted. Two fenwick trees over those
+    order indices track the number of lenses and the sum of their focal lengths, so
+    the slot of a lens and the focal lengths behind it are O(log n) queries.
+    """
+
+    def __init__(self, number: int):
+        self.number = number
+        self.lenses: dict[str, list[int]] = {}  # label -> [order index, focal length]
+        self.power = 0
+        self._reset()
+
+    def _reset(self):
+        self._slots = _FenwickTree()
+        self._focal_lengths = _FenwickTree()
+        self._total_focal_length = 0
+        for lens in self.lenses.values():
+            lens[0] = self._slots.append(1)
+            self._focal_lengths.append(lens[1])
+            self._total_focal_length += lens[1]
+
+    def set(self, label: str, focal_length: int):
+        if label in self.lenses:
+            order, previous = self.lenses[label]
+            slot = self._slots.prefix(order)
+            self.power += (self.number + 1) * slot * (focal_length - previous)
+            self._focal_lengths.add(order, focal_length - previous)
+            self._total_focal_length += focal_length - previous
+            self.lenses[label][1] = focal_length
+            return
+
+        order = self._slots.append(1)
+        self._focal_lengths.append(focal_length)
+        self._total_focal_length += focal_length
+        self.lenses[label] = [order, focal_length]
+        self.power += (self.number + 1) * len(self.lenses) * focal_length
+
+    def remove(self, label: str):
+        if label not in self.lenses:
+            return
+
+        order, focal_length = self.lenses.pop(label)
+        slot = self._slots.prefix(order)
+        # all lenses behind the removed one move forward by one slot
+        behind = self._total_focal_length - self._focal_lengths.prefix(order)
+        self.power -= (self.number + 1) * (slot * focal_length + behind)
+        self._slots.add(order, -1)
+        self._focal_lengths.add(order, -focal_length)
+        self._total_focal_length -= focal_length
+
+        # renumber once most order indices belong to removed lenses, to keep the
+        # memory proportional to the number of lenses in the box
+        if len(self._slots) > 2 * len(self.lenses) + 16:
+            self._reset()
+
+
+class FocusingHashmap:
+    """
+    HASHMAP that keeps the total focusing power current after every operation.
+    """
+
+    def __init__(self):
+        self.boxes = [_Box(number) for number in range(256)]
+        self.focusing_power = 0
+
+    def apply(self, op: str) -> int:
+        """
+        Apply a single `label=focal_length` or `label-` operation, other operations
+        are ignored.
+        """
+        match op.strip("-").split("="):
+            case [lens, focal_length]:
+                box = self.boxes[calc_hash(lens)]
+                self.focusing_power -= box.power
+                box.set(lens, int(focal_length))
+            case [lens]:
+                box = self.boxes[calc_hash(lens)]
+                self.focusing_power -= box.power
+                box.remove(lens)
+            case _:  # not a valid operation, skipped just like part2 does
+                return self.focusing_power
+
+        self.focusing_power += box.power
+        return self.focusing_power
+
+    def as_dict(self) -> dict[int, dict[str, int]]:
+        return {
+            box.number: {lens: focal for lens, (_, focal) in box.lenses.items()}
+            for box in self.boxes
+            if box.lenses
+        }
+
+
+def read_chunks(
+    source: str | os.PathLike | BinaryIO, chunk_size: int = 1 << 20
+) -> Iterator[bytes]:
+    """
+    Read an initialization sequence chunk by chunk, from a path or a binary file
+    object (which can also be an mmap).
+
+    Every yielded chunk holds only complete steps (newlines removed), a step that is
+    cut off at the end of a chunk is carried over to the next one.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as file:
+            yield from read_chunks(file, chunk_size)
+        return
+
+    remainder = b""
+    while chunk := source.read(chunk_size):
+        chunk = remainder + chunk.replace(b"\n", b"")
+        boundary = chunk.rfind(b",")
+        if boundary == -1:  # no complete step in this chunk yet
+            remainder = chunk
+            continue
+
+        yield chunk[:boundary]
+        remainder = chunk[boundary + 1 :]
+
+    if remainder:
+        yield remainder
+
+
+def stream_steps(
+    source: str | os.PathLike | BinaryIO, chunk_size: int = 1 << 20
+) -> Iterator[str]:
+    for chunk in read_chunks(source, chunk_size):
+        yield from chunk.decode().split(",")
+
+
+def process_stream(
+    source: str | os.PathLike | BinaryIO, chunk_size: int = 1 << 20
+) -> tuple[int, int]:
+    """
+    Compute both the sum of all step hashes (part 1) and the final focusing power
+    (part 2) in a single streaming pass over the initialization sequence.
+
+    Only one chunk and the lenses currently in the boxes are kept in memory.
+    """
+    hashmap = FocusingHashmap()
+    hash_sum = 0
+    for chunk in read_chunks(source, chunk_size):
+        hash_sum += int(hash_steps(chunk).sum(dtype=np.int64))
+        for step in chunk.decode().split(","):
+            hashmap.apply(step)
+
+    return hash_sum, hashmap.focusing_power
+
+
 @pytest.fixture()
 def puzzle_input():
     return parse(Puzzle(2023, 15).input_data)
@@ -62,15 +281,58 @@ rn=1,cm-,qp=3,cm=2,qp-,pc=4,ot=9,ab=5,pc-,pc=6,ot=7
 
 def test_part1(puzzle_input):
     assert part1(puzzle_input) == 505459
+    assert part1(Puzzle(2023, 15).input_data) == 505459
 
 
 def test_example_part1(example_input):
     assert part1(example_input) == 1320
 
 
+def test_hash_steps(example_input):
+    data = b"rn=1,cm-,qp=3,cm=2,\nqp-,pc=4,ot=9,ab=5,pc-,pc=6,ot=7\n"
+    expected = [calc_hash(step) for step in example_input]
+    assert hash_steps(data).tolist() == expected
+    assert hash_steps(b"HASH").tolist() == [52]
+    assert part1(data) == part1(data.decode()) == part1(example_input) == 1320
+
+
 def test_part2(puzzle_input):
     assert part2(puzzle_input) == 228508
 
 
 def test_example_part2(example_input):
     assert part2(example_input) == 145
+
+
+def test_focusing_hashmap(example_input):
+    hashmap = FocusingHashmap()
+    powers = [hashmap.apply(op) for op in example_input]
+    assert powers[-1] == 145
+    assert calc_focusing_power(hashmap.as_dict()) == 145
+
+    for i in range(1, len(example_input) + 1):
+        assert powers[i - 1] == part2(example_input[:i])
+
+    # rn, cm and bo all go into box 0, and many removals trigger compaction
+    ops = [f"{label}={i % 9 + 1}" for i, label in enumerate(["rn", "cm", "bo"] * 20)]
+    ops += ["rn-", "cm=5", "bo-", "rn=1", "bo=2"] * 20
+    hashmap = FocusingHashmap()
+    for i, op in enumerate(ops, start=1):
+        assert hashmap.apply(op) == part2(ops[:i])
+
+    assert hashmap.apply("ab=1=2") == part2(ops + ["ab=1=2"]) == part2(ops)
+
+
+def test_process_stream(example_input, tmp_path):
+    path = tmp_path / "input.txt"
+    path.write_text("rn=1,cm-,qp=3,cm=2,qp-,pc=4,ot=\n9,ab=5,pc-,pc=6,ot=7\n")
+
+    for chunk_size in (1, 3, 7, 1 << 20):
+        assert list(stream_steps(path, chunk_size)) == example_input
+        assert process_stream(path, chunk_size) == (1320, 145)
+
+    with (
+        open(path, "rb") as file,
+        mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as m,
+    ):
+        assert process_stream(m, chunk_size=5) == (1320, 145)
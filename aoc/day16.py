@@ -1,20 +1,31 @@
 from collections.abc import Iterator
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import os
 import pytest
 from aocd.models import Puzzle
 import numpy as np
+from numba import jit
+import networkx as nx
 
 UP = -1
 DOWN = 1
 LEFT = -1j
 RIGHT = 1j
 
+# tile and direction codes for the compiled tracer
+TILE_CODES = {".": 0, "/": 1, "\\": 2, "|": 3, "-": 4}
+DIRECTION_CODES = {UP: 0, RIGHT: 1, DOWN: 2, LEFT: 3}
+_DY = (-1, 0, 1, 0)
+_DX = (0, 1, 0, -1)
+
 
 def parse(data: str) -> np.ndarray:
     return np.array([list(l) for l in data.strip().splitlines()])
 
 
 def part1(grid: np.ndarray) -> int:
-    return calc_energized(grid, 0 + 0j, RIGHT)
+    return BeamTracer(grid).energized(0 + 0j, RIGHT)
 
 
 def calc_energized(
@@ -64,8 +75,316 @@ def trace(
     return energized.sum()
 
 
+def encode(grid: np.ndarray) -> np.ndarray:
+    tiles = np.zeros(grid.shape, dtype=np.uint8)
+    for symbol, code in TILE_CODES.items():
+        tiles[grid == symbol] = code
+    return tiles
+
+
+@jit(nopython=True)
+def _trace(
+    tiles: np.ndarray,
+    visited: np.ndarray,
+    stack: np.ndarray,
+    y: int,
+    x: int,
+    direction: int,
+) -> int:
+    """
+    Trace a beam entering tile (y, x) in the given direction, and return the number
+    of energized tiles.
+
+    visited is a (height, width) uint8 array, in which bit `d` of a tile is set once a
+    beam entered it in direction d. stack needs room for 4 * height * width states,
+    every state is pushed at most once.
+    """
+    height, width = tiles.shape
+    visited[:] = 0
+
+    visited[y, x] = 1 << direction
+    stack[0, 0], stack[0, 1], stack[0, 2] = y, x, direction
+    size = 1
+    energized = 1
+
+    next_directions = np.empty(2, dtype=np.int64)
+    while size > 0:
+        size -= 1
+        y, x, direction = stack[size, 0], stack[size, 1], stack[size, 2]
+
+        tile = tiles[y, x]
+        n = 1
+        if tile == 1:  # "/", swaps up <-> right and down <-> left
+            next_directions[0] = direction ^ 1
+        elif tile == 2:  # "\", swaps up <-> left and down <-> right
+            next_directions[0] = 3 - direction
+        elif tile == 3 and direction % 2 == 1:  # "|" hit from the left or right
+            next_directions[0], next_directions[1] = 0, 2
+            n = 2
+        elif tile == 4 and direction % 2 == 0:  # "-" hit from above or below
+            next_directions[0], next_directions[1] = 1, 3
+            n = 2
+        else:  # continue straight
+            next_directions[0] = direction
+
+        for i in range(n):
+            next_direction = next_directions[i]
+            next_y, next_x = y + _DY[next_direction], x + _DX[next_direction]
+            if not (0 <= next_y < height and 0 <= next_x < width):
+                continue
+
+            bit = 1 << next_direction
+            if visited[next_y, next_x] & bit:
+                continue
+            if visited[next_y, next_x] == 0:
+                energized += 1
+            visited[next_y, next_x] |= bit
+
+            stack[size, 0], stack[size, 1], stack[size, 2] = (
+                next_y,
+                next_x,
+                next_direction,
+            )
+            size += 1
+
+    return energized
+
+
+class BeamTracer:
+    """
+    Compiled beam tracer, reusing its buffers for every traced beam.
+    """
+
+    def __init__(self, grid: np.ndarray):
+        self._allocate(encode(grid))
+
+    @classmethod
+    def from_tiles(cls, tiles: np.ndarray) -> "BeamTracer":
+        """Create a tracer for an already encoded grid, without copying it"""
+        tracer = cls.__new__(cls)
+        tracer._allocate(tiles)
+        return tracer
+
+    def _allocate(self, tiles: np.ndarray):
+        self.tiles = tiles
+        self.visited = np.zeros(tiles.shape, dtype=np.uint8)
+        self._stack = np.empty((4 * tiles.size, 3), dtype=np.int64)
+
+    def energized(self, start_beam: complex, start_direction: complex) -> int:
+        """Number of energized tiles, for a beam entering start_beam in a direction"""
+        return _trace(
+            self.tiles,
+            self.visited,
+            self._stack,
+            int(start_beam.real),
+            int(start_beam.imag),
+            DIRECTION_CODES[start_direction],
+        )
+
+
+class SplitterGraph:
+    """
+    Shares the work of tracing beams between all start beams.
+
+    Between two splitters, a beam just follows the mirrors, so every splitter that
+    splits a beam always energizes the same tiles (its two outgoing paths) and
+    activates the same next splitters. Those splitters form a graph, whose strongly
+    connected components are condensed, and for every component the tiles energized
+    by it and all components reachable from it are stored as a bitset.
+
+    Energizing from a start beam is then following it to the first splitter, and
+    combining its path with the bitset of that splitter's component.
+    """
+
+    def __init__(self, grid: np.ndarray):
+        self.tiles = encode(grid)
+        self.height, self.width = grid.shape
+
+        graph = nx.DiGraph()
+        for y, x in zip(*np.nonzero((self.tiles == 3) | (self.tiles == 4))):
+            y, x = int(y), int(x)
+            splitter_bits = 1 << (y * self.width + x)
+            split_directions = (0, 2) if self.tiles[y, x] == 3 else (1, 3)
+            graph.add_node((y, x))
+            for direction in split_directions:
+                bits, next_splitter = self._follow(
+                    y + _DY[direction], x + _DX[direction], direction
+                )
+                splitter_bits |= bits
+                if next_splitter is not None:
+                    graph.add_edge((y, x), next_splitter)
+            graph.nodes[(y, x)]["bits"] = splitter_bits
+
+        condensed = nx.condensation(graph)
+        self._components: dict[tuple[int, int], int] = condensed.graph["mapping"]
+        self._energized: dict[int, int] = {}  # bitset per component
+        for component in reversed(list(nx.topological_sort(condensed))):
+            bits = 0
+            for splitter in condensed.nodes[component]["members"]:
+                bits |= graph.nodes[splitter]["bits"]
+            for successor in condensed.successors(component):
+                bits |= self._energized[successor]
+            self._energized[component] = bits
+
+    def _follow(
+        self, y: int, x: int, direction: int
+    ) -> tuple[int, tuple[int, int] | None]:
+        """
+        Follow a beam until it leaves the grid or gets split by a splitter.
+
+        Returns:
+            The bitset of the tiles on the way (excluding the splitter), and the
+            splitter that split the beam, or None if it left the grid.
+        """
+        bits = 0
+        seen = set()
+        while 0 <= y < self.height and 0 <= x < self.width:
+            tile = self.tiles[y, x]
+            if (tile == 3 and direction % 2 == 1) or (tile == 4 and direction % 2 == 0):
+                return bits, (y, x)
+            if (y, x, direction) in seen:  # looped back onto the path through mirrors
+                break
+            seen.add((y, x, direction))
+
+            bits |= 1 << (y * self.width + x)
+            if tile == 1:  # "/"
+                direction ^= 1
+            elif tile == 2:  # "\"
+                direction = 3 - direction
+            y, x = y + _DY[direction], x + _DX[direction]
+
+        return bits, None
+
+    def energized(self, start_beam: complex, start_direction: complex) -> int:
+        bits, splitter = self._follow(
+            int(start_beam.real),
+            int(start_beam.imag),
+            DIRECTION_CODES[start_direction],
+        )
+        if splitter is not None:
+            bits |= self._energized[self._components[splitter]]
+        return bits.bit_count()
+
+
 def part2(grid: np.ndarray) -> int:
-    return max(calc_energized(grid, *start_beam) for start_beam in start_beams(grid))
+    graph = SplitterGraph(grid)
+    return max(graph.energized(*start_beam) for start_beam in start_beams(grid))
+
+
+class IncrementalEnergizer:
+    """
+    Keeps the energized counts of start beams up to date while tiles are edited.
+
+    For every tile, the ids of the start beams that visited it are kept as a bitset.
+    A beam can only change if it passes through an edited tile, so after an edit only
+    the beams in the bitset of that tile are traced again.
+    """
+
+    def __init__(
+        self, grid: np.ndarray, beams: list[tuple[complex, complex]] | None = None
+    ):
+        self.tracer = BeamTracer(grid)
+        self.beams = list(start_beams(grid)) if beams is None else beams
+        # bit i % 64 of visited_by[i // 64, tile] is set if beam i visited the tile,
+        # every row of 64 beams is contiguous, so a beam can be updated in one go
+        self.visited_by = np.zeros(
+            ((len(self.beams) + 63) // 64, grid.size), dtype=np.uint64
+        )
+        self.energized = np.zeros(len(self.beams), dtype=np.int64)
+        for i in range(len(self.beams)):
+            self._trace(i)
+
+    def _trace(self, i: int):
+        """Trace beam i again and move its bit to the tiles it visits now"""
+        self.energized[i] = self.tracer.energized(*self.beams[i])
+        row = self.visited_by[i // 64]
+        bit = np.uint64(1 << (i % 64))
+        row &= ~bit
+        row[np.flatnonzero(self.tracer.visited)] |= bit
+
+    def beams_visiting(self, position: complex) -> np.ndarray:
+        """Indices of the beams that visited the tile at position"""
+        y, x = int(position.real), int(position.imag)
+        words = self.visited_by[:, y * self.tracer.tiles.shape[1] + x]
+        bits = np.unpackbits(words.astype("<u8").view(np.uint8), bitorder="little")
+        return np.flatnonzero(bits[: len(self.beams)])
+
+    def set_tile(self, position: complex, symbol: str) -> np.ndarray:
+        """
+        Replace a single tile and update the energized counts of all affected beams.
+
+        Returns:
+            The indices of the beams that were traced again
+        """
+        y, x = int(position.real), int(position.imag)
+        if self.tracer.tiles[y, x] == TILE_CODES[symbol]:
+            return np.array([], dtype=int)
+
+        self.tracer.tiles[y, x] = TILE_CODES[symbol]
+        affected = self.beams_visiting(position)
+        for i in affected:
+            self._trace(i)
+        return affected
+
+    def max(self) -> int:
+        return int(self.energized.max())
+
+
+# per worker process state for part2_parallel
+_worker_memory: shared_memory.SharedMemory | None = None
+_worker_tracer: BeamTracer | None = None
+
+
+def _init_worker(memory_name: str, shape: tuple[int, int]):
+    global _worker_memory, _worker_tracer
+    # keep a reference to the shared memory, the tiles are only a view into it
+    _worker_memory = shared_memory.SharedMemory(name=memory_name)
+    tiles = np.ndarray(shape, dtype=np.uint8, buffer=_worker_memory.buf)
+    _worker_tracer = BeamTracer.from_tiles(tiles)
+
+
+def _energize_beams(beams: list[tuple[complex, complex]]) -> list[int]:
+    assert _worker_tracer is not None
+    return [_worker_tracer.energized(*beam) for beam in beams]
+
+
+def part2_parallel(
+    grid: np.ndarray, processes: int | None = None
+) -> tuple[int, dict[tuple[complex, complex], int]]:
+    """
+    Evaluate all start beams of part 2 in a pool of worker processes.
+
+    The encoded grid is placed in shared memory once, which all workers attach to,
+    instead of pickling it for every task.
+
+    Returns:
+        The maximum number of energized tiles, and the number of energized tiles for
+        every start beam.
+    """
+    beams = list(start_beams(grid))
+    tiles = encode(grid)
+    processes = processes or os.cpu_count() or 1
+    # a few chunks per process, to balance out beams of very different lengths
+    n_chunks = min(len(beams), 4 * processes)
+    chunks = [beams[i::n_chunks] for i in range(n_chunks)]
+
+    memory = shared_memory.SharedMemory(create=True, size=tiles.nbytes)
+    try:
+        np.ndarray(tiles.shape, dtype=np.uint8, buffer=memory.buf)[...] = tiles
+        with ProcessPoolExecutor(
+            processes, initializer=_init_worker, initargs=(memory.name, tiles.shape)
+        ) as pool:
+            results = list(pool.map(_energize_beams, chunks))
+    finally:
+        memory.close()
+        memory.unlink()
+
+    energized = {
+        beam: count
+        for chunk, counts in zip(chunks, results)
+        for beam, count in zip(chunk, counts)
+    }
+    return max(energized.values()), energized
 
 
 def start_beams(grid: np.ndarray) -> Iterator[tuple[complex, complex]]:
@@ -117,3 +436,53 @@ def test_part2(puzzle_input):
 
 def test_example_part2(example_input):
     assert part2(example_input) == 51
+
+
+def test_beam_tracer(example_input):
+    tracer = BeamTracer(example_input)
+    for start_beam in start_beams(example_input):
+        assert tracer.energized(*start_beam) == calc_energized(
+            example_input, *start_beam
+        )
+        assert (tracer.visited > 0).sum() == tracer.energized(*start_beam)
+
+
+def test_splitter_graph(example_input):
+    graph = SplitterGraph(example_input)
+    tracer = BeamTracer(example_input)
+    for start_beam in start_beams(example_input):
+        assert graph.energized(*start_beam) == tracer.energized(*start_beam)
+
+
+def test_part2_parallel(example_input):
+    best, energized = part2_parallel(example_input, processes=2)
+    assert best == 51
+    assert len(energized) == 2 * sum(example_input.shape)
+    assert energized[(0, RIGHT)] == part1(example_input)
+
+
+def test_incremental_energizer(example_input):
+    energizer = IncrementalEnergizer(example_input)
+    assert energizer.max() == 51
+
+    grid = example_input.copy()
+    for position, symbol in [
+        (0 + 5j, "/"),
+        (1 + 2j, "|"),
+        (7 + 4j, "."),
+        (0 + 5j, "\\"),
+    ]:
+        grid[int(position.real), int(position.imag)] = symbol
+        affected = energizer.set_tile(position, symbol)
+        assert 0 < len(affected) < len(energizer.beams)
+
+        tracer = BeamTracer(grid)
+        visiting = {
+            y + x * 1j: [] for y in range(grid.shape[0]) for x in range(grid.shape[1])
+        }
+        for i, beam in enumerate(energizer.beams):
+            assert energizer.energized[i] == tracer.energized(*beam)
+            for y, x in zip(*np.nonzero(tracer.visited)):
+                visiting[y + x * 1j].append(i)
+        for tile, beams in visiting.items():
+            assert energizer.beams_visiting(tile).tolist() == beams
@@ -1,7 +1,10 @@
+from collections.abc import Iterator
+import heapq
 from queue import PriorityQueue
 import pytest
 from aocd.models import Puzzle
 import numpy as np
+from numba import jit
 from dataclasses import field, dataclass
 
 
@@ -18,10 +21,451 @@ class CityBlock:
     min_heat_loss: int
     pos: tuple[int, int] = field(compare=False)
     direction: int = field(compare=False)  # 1 = up/down, -1 = left/right
-    prev: "CityBlock | None" = field(compare=False, default=None)
 
 
 def minimum_heat_loss(
+    grid: np.ndarray,
+    min_straight: int = 1,
+    max_straight: int = 3,
+    engine: str = "dial",
+    astar: bool = False,
+) -> int:
+    """
+    Minimum heat loss from the top left to the bottom right city block.
+
+    Args:
+        engine: "dial" for the compiled bucket queue search, or "priority_queue" for
+            the original search using CityBlock objects
+        astar: Use A* instead of plain Dijkstra (only for the "dial" engine)
+    """
+    if engine == "dial":
+        return crucible_search(grid, min_straight, max_straight, astar).heat_loss
+    if engine == "priority_queue":
+        return _minimum_heat_loss_priority_queue(grid, min_straight, max_straight)
+
+    raise ValueError(f"Unknown engine {engine}")
+
+
+@dataclass
+class SearchResult:
+    heat_loss: int
+    expanded: int  # number of states taken from the queue
+    path: list[tuple[int, int]] | None = None  # all city blocks from start to target
+
+
+def crucible_search(
+    grid: np.ndarray,
+    min_straight: int = 1,
+    max_straight: int = 3,
+    astar: bool = False,
+    return_path: bool = False,
+) -> SearchResult:
+    """
+    Search the minimum heat loss path to the bottom right city block.
+
+    With astar, the search is guided by the heat loss from every city block to the
+    target without any constraints on moving straight (see reverse_heat_loss), which
+    is a lower bound for any min_straight / max_straight.
+
+    Only the predecessor of every state is kept during the search, with return_path
+    the path is rebuilt from those afterwards.
+    """
+    height, width = grid.shape
+    grid = grid.astype(np.int32)
+    if astar:
+        heuristic = reverse_heat_loss(grid, height - 1, width - 1)
+    else:
+        heuristic = np.zeros_like(grid)
+
+    distances = np.empty(grid.size * 2, dtype=np.int32)
+    predecessors = np.empty(grid.size * 2, dtype=np.int32)
+    heat_loss, expanded, target = _dial_search(
+        grid,
+        heuristic,
+        min_straight,
+        max_straight,
+        height - 1,
+        width - 1,
+        distances,
+        predecessors,
+    )
+
+    result = SearchResult(int(heat_loss), int(expanded))
+    if return_path and target != -1:
+        result.path = rebuild_path(predecessors, int(target), width)
+    return result
+
+
+def rebuild_path(
+    predecessors: np.ndarray, state: int, width: int
+) -> list[tuple[int, int]]:
+    """All city blocks on the way to the given state, following its predecessors"""
+    turns = [state // 2]
+    while predecessors[state] != -1:
+        state = int(predecessors[state])
+        turns.append(state // 2)
+    turns.reverse()
+
+    path = [(0, 0)]
+    for position in turns[1:]:
+        y, x = divmod(position, width)
+        prev_y, prev_x = path[-1]
+        steps = abs(y - prev_y) + abs(x - prev_x)
+        dy, dx = (y - prev_y) // steps, (x - prev_x) // steps
+        path.extend(
+            (prev_y + dy * step, prev_x + dx * step) for step in range(1, steps + 1)
+        )
+
+    return path
+
+
+class CrucibleSolver:
+    """
+    Answers many heat loss queries on the same grid.
+
+    For every (min_straight, max_straight) pair, a single search from the top left
+    city block is run until all states are settled. Its distance and predecessor
+    tables are cached, so the heat loss to any target is a lookup afterwards.
+    """
+
+    def __init__(self, grid: np.ndarray):
+        self.grid = grid.astype(np.int32)
+        self._tables: dict[tuple[int, int], tuple[np.ndarray, np.ndarray]] = {}
+
+    def tables(
+        self, min_straight: int = 1, max_straight: int = 3
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Distances and predecessors of all states, see _dial_search"""
+        key = (min_straight, max_straight)
+        if key not in self._tables:
+            distances = np.empty(self.grid.size * 2, dtype=np.int32)
+            predecessors = np.empty(self.grid.size * 2, dtype=np.int32)
+            _dial_search(
+                self.grid,
+                np.zeros_like(self.grid),
+                min_straight,
+                max_straight,
+                -1,  # no target, settle all states
+                -1,
+                distances,
+                predecessors,
+            )
+            self._tables[key] = distances, predecessors
+        return self._tables[key]
+
+    def _target_state(
+        self, target: tuple[int, int], min_straight: int, max_straight: int
+    ) -> int | None:
+        distances, _ = self.tables(min_straight, max_straight)
+        y, x = target
+        position = y * self.grid.shape[1] + x
+        # the target can be reached moving vertically or horizontally
+        state = min(position * 2, position * 2 + 1, key=lambda state: distances[state])
+        return None if distances[state] == INFINITY else state
+
+    def heat_loss(
+        self, target: tuple[int, int], min_straight: int = 1, max_straight: int = 3
+    ) -> int:
+        """Minimum heat loss to the target, or -1 if it can't be reached"""
+        state = self._target_state(target, min_straight, max_straight)
+        if state is None:
+            return -1
+        distances, _ = self.tables(min_straight, max_straight)
+        return int(distances[state])
+
+    def path(
+        self, target: tuple[int, int], min_straight: int = 1, max_straight: int = 3
+    ) -> list[tuple[int, int]] | None:
+        state = self._target_state(target, min_straight, max_straight)
+        if state is None:
+            return None
+        _, predecessors = self.tables(min_straight, max_straight)
+        return rebuild_path(predecessors, state, self.grid.shape[1])
+
+
+class DynamicCrucibleSearch:
+    """
+    Keeps the heat loss table of all states up to date while city blocks change.
+
+    This is LPA* without a heuristic (every state is of interest) over the same turn
+    based state graph as _dial_search. Next to the distance g of every state, it
+    keeps rhs, the best distance via its predecessors. After changing a block, only
+    the states reached by a move over that block get a new rhs, and the changes
+    only spread from those states as far as distances actually change.
+    """
+
+    def __init__(self, grid: np.ndarray, min_straight: int = 1, max_straight: int = 3):
+        self.min_straight = min_straight
+        self.max_straight = max_straight
+        solver = CrucibleSolver(grid)
+        self.grid = solver.grid
+        distances, _ = solver.tables(min_straight, max_straight)
+        self.distances = distances  # g
+        self.rhs = distances.copy()
+        self._queue: list[tuple[int, int]] = []
+
+    def heat_loss(self, target: tuple[int, int] | None = None) -> int:
+        height, width = self.grid.shape
+        y, x = (height - 1, width - 1) if target is None else target
+        position = y * width + x
+        heat_loss = min(self.distances[position * 2], self.distances[position * 2 + 1])
+        return -1 if heat_loss == INFINITY else int(heat_loss)
+
+    def _moves(self, state: int, backwards: bool = False) -> Iterator[tuple[int, int]]:
+        """
+        (state, heat loss) of all moves starting in the given state, or with
+        backwards of all moves ending in it.
+        """
+        height, width = self.grid.shape
+        position, axis = divmod(state, 2)
+        y, x = divmod(position, width)
+        horizontal = (axis == 1) != backwards
+        for sign in (-1, 1):
+            dy, dx = (0, sign) if horizontal else (sign, 0)
+            heat_loss = 0
+            for step in range(1, self.max_straight + 1):
+                next_y, next_x = y + dy * step, x + dx * step
+                if not (0 <= next_y < height and 0 <= next_x < width):
+                    break
+
+                # moves lose the heat of every block they enter, so going backwards
+                # the heat of the current block counts, but not the one we end in
+                offset = step - 1 if backwards else step
+                heat_loss += int(self.grid[y + dy * offset, x + dx * offset])
+                if step >= self.min_straight:
+                    yield (next_y * width + next_x) * 2 + 1 - axis, heat_loss
+
+    def _update_state(self, state: int):
+        if state > 1:  # the start states always have a distance of 0
+            self.rhs[state] = min(
+                (
+                    int(self.distances[prev]) + heat_loss
+                    for prev, heat_loss in self._moves(state, backwards=True)
+                    if self.distances[prev] != INFINITY
+                ),
+                default=INFINITY,
+            )
+        if self.distances[state] != self.rhs[state]:
+            key = min(self.distances[state], self.rhs[state])
+            heapq.heappush(self._queue, (int(key), state))
+
+    def update(self, blocks: dict[tuple[int, int], int]) -> int:
+        """
+        Change the heat loss of the given city blocks and repair the distances.
+
+        Returns:
+            The number of states taken from the queue during the repair
+        """
+        height, width = self.grid.shape
+        affected = set()
+        for (y, x), heat_loss in blocks.items():
+            self.grid[y, x] = heat_loss
+            # all moves over this block end at most max_straight - 1 blocks behind it
+            for step in range(-self.max_straight + 1, self.max_straight):
+                if 0 <= x + step < width:
+                    affected.add((y * width + x + step) * 2)  # moved horizontally
+                if 0 <= y + step < height:
+                    affected.add(((y + step) * width + x) * 2 + 1)  # moved vertically
+
+        for state in affected:
+            self._update_state(state)
+
+        expanded = 0
+        while self._queue:
+            key, state = heapq.heappop(self._queue)
+            g, rhs = self.distances[state], self.rhs[state]
+            if g == rhs or key != min(g, rhs):  # outdated queue entry
+                continue
+
+            expanded += 1
+            if g > rhs:  # distance decreased
+                self.distances[state] = rhs
+            else:  # distance increased, recompute it from the predecessors
+                self.distances[state] = INFINITY
+                self._update_state(state)
+            for next_state, _ in self._moves(state):
+                self._update_state(next_state)
+
+        return expanded
+
+
+INFINITY = np.iinfo(np.int32).max
+
+
+@jit(nopython=True)
+def _link(
+    heads: np.ndarray, next_: np.ndarray, prev: np.ndarray, state: int, bucket: int
+):
+    prev[state] = -1
+    next_[state] = heads[bucket]
+    if heads[bucket] != -1:
+        prev[heads[bucket]] = state
+    heads[bucket] = state
+
+
+@jit(nopython=True)
+def _unlink(
+    heads: np.ndarray, next_: np.ndarray, prev: np.ndarray, state: int, bucket: int
+):
+    if prev[state] == -1:
+        heads[bucket] = next_[state]
+    else:
+        next_[prev[state]] = next_[state]
+    if next_[state] != -1:
+        prev[next_[state]] = prev[state]
+
+
+@jit(nopython=True)
+def reverse_heat_loss(grid: np.ndarray, target_y: int, target_x: int) -> np.ndarray:
+    """
+    Heat loss from every city block to the target, when moving freely between
+    neighbouring blocks (Dial's algorithm backwards from the target).
+    """
+    height, width = grid.shape
+    n_buckets = grid.max() + 1
+
+    heads = np.full(n_buckets, -1, dtype=np.int32)
+    next_ = np.empty(grid.size, dtype=np.int32)
+    prev = np.empty(grid.size, dtype=np.int32)
+    distances = np.full(grid.size, INFINITY, dtype=np.int32)
+    settled = np.zeros(grid.size, dtype=np.bool_)
+
+    target = target_y * width + target_x
+    distances[target] = 0
+    _link(heads, next_, prev, target, 0)
+    queued = 1
+
+    current = 0
+    while queued > 0:
+        while heads[current % n_buckets] == -1:
+            current += 1
+        block = heads[current % n_buckets]
+        _unlink(heads, next_, prev, block, current % n_buckets)
+        queued -= 1
+        settled[block] = True
+
+        y, x = block // width, block % width
+        # moving from a neighbour onto this block loses the heat of this block
+        distance = distances[block] + grid[y, x]
+        for dy, dx in ((-1, 0), (1, 0), (0, -1), (0, 1)):
+            next_y, next_x = y + dy, x + dx
+            if not (0 <= next_y < height and 0 <= next_x < width):
+                continue
+
+            neighbour = next_y * width + next_x
+            if settled[neighbour] or distance >= distances[neighbour]:
+                continue
+
+            if distances[neighbour] == INFINITY:
+                queued += 1
+            else:
+                bucket = distances[neighbour] % n_buckets
+                _unlink(heads, next_, prev, neighbour, bucket)
+            distances[neighbour] = distance
+            _link(heads, next_, prev, neighbour, distance % n_buckets)
+
+    return distances.reshape(grid.shape)
+
+
+@jit(nopython=True)
+def _dial_search(
+    grid: np.ndarray,
+    heuristic: np.ndarray,
+    min_straight: int,
+    max_straight: int,
+    target_y: int,
+    target_x: int,
+    distances: np.ndarray,
+    predecessors: np.ndarray,
+) -> tuple[int, int, int]:
+    """
+    Dijkstra with a bucket queue (Dial's algorithm) over flat state indices.
+
+    The state (y, x, axis) has the index (y * width + x) * 2 + axis, where axis 1
+    means the next move is horizontal and axis 0 means it is vertical (the same as
+    the direction 1 and -1 of a CityBlock).
+
+    States are queued by distance + heuristic (A*, or plain Dijkstra for a heuristic
+    of all zeros). A move costs at most max(grid) * max_straight, and for a
+    consistent heuristic it changes the queue key by at most twice that, so all
+    queued keys fit into a circular array of that many + 1 buckets. Each bucket is a
+    doubly linked list of states, so a state that gets a lower distance is moved to
+    another bucket instead of leaving a stale duplicate in the queue.
+
+    The final distance of every settled state is written to distances, and the
+    state it was reached from to predecessors (-1 for the start states).
+
+    Returns:
+        The distance to the target (or -1 if it can't be reached), the number of
+        expanded states and the state in which the target was reached (or -1)
+    """
+    height, width = grid.shape
+    n_states = height * width * 2
+    n_buckets = grid.max() * max_straight * 2 + 1
+
+    heads = np.full(n_buckets, -1, dtype=np.int32)
+    next_ = np.empty(n_states, dtype=np.int32)
+    prev = np.empty(n_states, dtype=np.int32)
+    settled = np.zeros(n_states, dtype=np.bool_)
+    distances[:] = INFINITY
+
+    # start at the top left corner, facing down or right
+    for state in (0, 1):
+        distances[state] = 0
+        predecessors[state] = -1
+        _link(heads, next_, prev, state, heuristic[0, 0] % n_buckets)
+    queued = 2
+    expanded = 0
+
+    current = heuristic[0, 0]
+    while queued > 0:
+        while heads[current % n_buckets] == -1:
+            current += 1
+        state = heads[current % n_buckets]
+        _unlink(heads, next_, prev, state, current % n_buckets)
+        queued -= 1
+        settled[state] = True
+        expanded += 1
+
+        position, axis = state // 2, state % 2
+        y, x = position // width, position % width
+        if y == target_y and x == target_x:
+            return distances[state], expanded, state
+
+        # move straight in both directions along the axis, and then turn
+        for sign in (-1, 1):
+            sum_straight = 0
+            for step in range(1, max_straight + 1):
+                next_y = y if axis == 1 else y + step * sign
+                next_x = x + step * sign if axis == 1 else x
+                if not (0 <= next_y < height and 0 <= next_x < width):
+                    break
+
+                sum_straight += grid[next_y, next_x]
+                if step < min_straight:
+                    continue
+
+                next_state = (next_y * width + next_x) * 2 + 1 - axis
+                distance = distances[state] + sum_straight
+                if settled[next_state] or distance >= distances[next_state]:
+                    continue
+
+                remaining = heuristic[next_y, next_x]
+                if distances[next_state] == INFINITY:
+                    queued += 1
+                else:
+                    bucket = (distances[next_state] + remaining) % n_buckets
+                    _unlink(heads, next_, prev, next_state, bucket)
+                distances[next_state] = distance
+                predecessors[next_state] = state
+                _link(
+                    heads, next_, prev, next_state, (distance + remaining) % n_buckets
+                )
+
+    return -1, expanded, -1
+
+
+def _minimum_heat_loss_priority_queue(
     grid: np.ndarray, min_straight: int = 1, max_straight: int = 3
 ) -> int:
     height, width = grid.shape
@@ -72,7 +516,6 @@ def minimum_heat_loss(
                                 state.min_heat_loss + sum_straight,
                                 (y, next_x),
                                 state.direction * -1,
-                                state,
                             )
                         )
         else:  # current left or right => transition to up or down
@@ -90,7 +533,6 @@ def minimum_heat_loss(
                                 state.min_heat_loss + sum_straight,
                                 (next_y, x),
                                 state.direction * -1,
-                                state,
                             )
                         )
 
@@ -141,3 +583,70 @@ def test_part2(puzzle_input):
 
 def test_example_part2(example_input):
     assert part2(example_input) == 94
+
+
+def test_dial_engine(example_input):
+    for min_straight, max_straight in [(1, 3), (4, 10), (1, 1), (2, 5)]:
+        assert minimum_heat_loss(
+            example_input, min_straight, max_straight, engine="dial"
+        ) == minimum_heat_loss(
+            example_input, min_straight, max_straight, engine="priority_queue"
+        )
+
+
+def test_astar(example_input):
+    for min_straight, max_straight in [(1, 3), (4, 10)]:
+        dijkstra = crucible_search(example_input, min_straight, max_straight)
+        astar = crucible_search(example_input, min_straight, max_straight, astar=True)
+        assert astar.heat_loss == dijkstra.heat_loss
+        assert astar.expanded < dijkstra.expanded
+
+    assert reverse_heat_loss(example_input, 12, 12)[12, 11] == 3
+
+
+def test_return_path(example_input):
+    for min_straight, max_straight in [(1, 3), (4, 10)]:
+        result = crucible_search(
+            example_input, min_straight, max_straight, astar=True, return_path=True
+        )
+        assert result.path is not None
+        assert result.path[0] == (0, 0)
+        assert result.path[-1] == (12, 12)
+        assert sum(example_input[y, x] for y, x in result.path[1:]) == result.heat_loss
+
+    assert crucible_search(example_input).path is None
+
+
+def test_crucible_solver(example_input):
+    solver = CrucibleSolver(example_input)
+    assert solver.heat_loss((12, 12)) == 102
+    assert solver.heat_loss((12, 12), 4, 10) == 94
+    assert solver.heat_loss((0, 0)) == 0
+    assert solver.heat_loss((0, 1)) == 4
+
+    for target in [(3, 7), (12, 0), (5, 5)]:
+        for min_straight, max_straight in [(1, 3), (4, 10)]:
+            heat_loss = solver.heat_loss(target, min_straight, max_straight)
+            path = solver.path(target, min_straight, max_straight)
+            assert path is not None and path[-1] == target
+            assert sum(example_input[y, x] for y, x in path[1:]) == heat_loss
+
+    assert len(solver._tables) == 2
+
+
+def test_dynamic_search(example_input):
+    search = DynamicCrucibleSearch(example_input)
+    assert search.heat_loss() == 102
+
+    grid = example_input.copy()
+    for changes in [{(12, 12): 9}, {(11, 12): 1, (6, 6): 1}, {(0, 1): 9, (5, 0): 1}]:
+        for block, heat_loss in changes.items():
+            grid[block] = heat_loss
+        search.update(changes)
+
+        distances, _ = CrucibleSolver(grid).tables()
+        assert (search.distances == distances).all()
+        assert search.heat_loss() == minimum_heat_loss(grid)
+
+    # changes far away from the start only affect a few states
+    assert search.update({(12, 11): 1}) < 0.1 * grid.size * 2
@@ -1,5 +1,12 @@
+import os
+from collections.abc import Iterable
+from dataclasses import dataclass
+from typing import BinaryIO
+
+import numpy as np
 import pytest
 from aocd.models import Puzzle
+from numba import jit
 
 
 def parse(data: str) -> list[tuple[str, int, str]]:
@@ -59,6 +66,315 @@ def part2(plan: list[tuple[str, int, str]]) -> int:
     )
 
 
+# direction vectors indexed by the direction letter (part 1) or digit (part 2)
+_LETTER_DIRECTIONS = np.zeros((256, 2), dtype=np.int64)
+_LETTER_DIRECTIONS[[ord("R"), ord("L"), ord("U"), ord("D")]] = [
+    (0, 1),
+    (0, -1),
+    (-1, 0),
+    (1, 0),
+]
+_DIGIT_DIRECTIONS = np.zeros((256, 2), dtype=np.int64)
+_DIGIT_DIRECTIONS[[ord("0"), ord("1"), ord("2"), ord("3")]] = [
+    (0, 1),
+    (1, 0),
+    (0, -1),
+    (-1, 0),
+]
+_HEX_VALUES = np.zeros(256, dtype=np.int64)
+_HEX_VALUES[np.frombuffer(b"0123456789abcdef", dtype=np.uint8)] = np.arange(16)
+
+
+def parse_bytes(data: bytes, use_hex: bool = False) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Decode a whole dig plan straight from its bytes, without splitting any strings.
+
+    Args:
+        use_hex: Decode the instructions from the hex values (part 2) instead of
+            the direction letters and lengths (part 1)
+
+    Returns:
+        The (dy, dx) direction vectors and the lengths of all instructions, as int64
+        arrays
+    """
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    # every line looks like "R 6 (#70c710)", which takes at least 14 bytes
+    directions = np.empty((len(buffer) // 13 + 1, 2), dtype=np.int64)
+    lengths = np.empty(len(buffer) // 13 + 1, dtype=np.int64)
+    n = _parse_plan(
+        buffer,
+        _DIGIT_DIRECTIONS if use_hex else _LETTER_DIRECTIONS,
+        _HEX_VALUES,
+        use_hex,
+        directions,
+        lengths,
+    )
+    return directions[:n], lengths[:n]
+
+
+@jit(nopython=True)
+def _parse_plan(
+    buffer: np.ndarray,
+    direction_table: np.ndarray,
+    hex_values: np.ndarray,
+    use_hex: bool,
+    directions: np.ndarray,
+    lengths: np.ndarray,
+) -> int:
+    """
+    Decode all lines of the buffer in a single pass, and return the number of lines.
+    """
+    n = 0
+    i = 0
+    size = len(buffer)
+    while i < size:
+        if buffer[i] <= 32:  # skip line breaks and blank lines
+            i += 1
+            continue
+
+        letter = buffer[i]
+        i += 2
+        length = 0
+        while buffer[i] != 32:  # ord(" ")
+            length = length * 10 + buffer[i] - 48  # ord("0")
+            i += 1
+        i += 3  # skip the " (#"
+
+        if use_hex:
+            length = 0
+            for j in range(5):
+                length = length * 16 + hex_values[buffer[i + j]]
+            directions[n, 0] = direction_table[buffer[i + 5], 0]
+            directions[n, 1] = direction_table[buffer[i + 5], 1]
+        else:
+            directions[n, 0] = direction_table[letter, 0]
+            directions[n, 1] = direction_table[letter, 1]
+        lengths[n] = length
+        n += 1
+        i += 7  # skip the "70c710)"
+
+    return n
+
+
+def calc_area_bulk(directions: np.ndarray, lengths: np.ndarray) -> int:
+    """
+    Same as calc_area, but with vectorized shoelace formula and pick's theorem.
+    """
+    accumulator = AreaAccumulator()
+    accumulator.add_many(directions, lengths)
+    return accumulator.area
+
+
+def _shoelace(vertices: np.ndarray) -> int:
+    """
+    Shoelace sum of the (y, x) vertices of a path.
+
+    If the sum could overflow int64, it is computed with exact python ints instead.
+    """
+    y, x = vertices[:, 0], vertices[:, 1]
+
+    # every term of the sum is at most 2 * max|x| * max|y|, which is cheap to check
+    y_max = float(max(-y.min(), y.max()))
+    x_max = float(max(-x.min(), x.max()))
+    if 2 * len(vertices) * y_max * x_max >= 2**62:
+        # estimate the magnitude of the sum term by term, to check if it fits
+        y_abs, x_abs = np.abs(y).astype(np.float64), np.abs(x).astype(np.float64)
+        if x_abs[:-1] @ y_abs[1:] + y_abs[:-1] @ x_abs[1:] >= 2**62:
+            y, x = y.astype(object), x.astype(object)
+
+    return int(x[:-1] @ y[1:] - y[:-1] @ x[1:])
+
+
+@dataclass
+class AreaAccumulator:
+    """
+    Running state of calc_area, so instructions can be added one (chunk) at a time
+    without keeping the plan in memory.
+    """
+
+    y: int = 0
+    x: int = 0
+    perimeter: int = 0
+    shoelace: int = 0
+
+    def add(self, direction: tuple[int, int], n: int):
+        dy, dx = direction
+        y2, x2 = self.y + dy * n, self.x + dx * n
+        self.perimeter += n
+        self.shoelace += self.x * y2 - self.y * x2
+        self.y, self.x = y2, x2
+
+    def add_many(self, directions: np.ndarray, lengths: np.ndarray):
+        """Add a whole chunk of instructions, in vectorized form"""
+        if len(lengths) == 0:
+            return
+
+        # no vertex can be further from the chunk start than the whole chunk
+        if lengths.sum(dtype=np.float64) >= 2**62:
+            directions, lengths = directions.astype(object), lengths.astype(object)
+
+        # vertices relative to the current position
+        steps = directions * lengths[:, None]
+        vertices = np.zeros((len(steps) + 1, 2), dtype=steps.dtype)
+        np.cumsum(steps, axis=0, out=vertices[1:])
+        dy, dx = int(vertices[-1, 0]), int(vertices[-1, 1])
+
+        # moving all vertices by (y, x) changes the sum of their shoelace terms by
+        # x * dy - y * dx, where (dy, dx) is the offset from the first to the last
+        self.shoelace += _shoelace(vertices) + self.x * dy - self.y * dx
+        self.perimeter += int(lengths.sum())
+        self.y, self.x = self.y + dy, self.x + dx
+
+    @property
+    def area(self) -> int:
+        return (abs(self.shoelace) + self.perimeter) // 2 + 1  # pick's theorem
+
+
+def area_from_lines(lines: Iterable[str], use_hex: bool = False) -> int:
+    """Area of a dig plan, streamed from an iterator over its lines"""
+    accumulator = AreaAccumulator()
+    for line in lines:
+        if not line.strip():
+            continue
+        direction, num, hex_value = line.split()
+        if use_hex:
+            hex_value = hex_value.lstrip("(#").rstrip(")")
+            vector = _DIGIT_DIRECTIONS[ord(hex_value[5])]
+            accumulator.add((int(vector[0]), int(vector[1])), int(hex_value[:5], 16))
+        else:
+            vector = _LETTER_DIRECTIONS[ord(direction)]
+            accumulator.add((int(vector[0]), int(vector[1])), int(num))
+
+    return accumulator.area
+
+
+def area_from_file(
+    source: str | os.PathLike | BinaryIO,
+    use_hex: bool = False,
+    chunk_size: int = 1 << 20,
+) -> int:
+    """
+    Area of a dig plan, read from a path or binary file one chunk at a time.
+
+    Every chunk is cut at its last line break and decoded with parse_bytes, only the
+    incomplete last line is carried over to the next chunk.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as file:
+            return area_from_file(file, use_hex, chunk_size)
+
+    accumulator = AreaAccumulator()
+    remainder = b""
+    while chunk := source.read(chunk_size):
+        chunk = remainder + chunk
+        boundary = chunk.rfind(b"\n") + 1
+        remainder = chunk[boundary:]
+        accumulator.add_many(*parse_bytes(chunk[:boundary], use_hex))
+
+    accumulator.add_many(*parse_bytes(remainder, use_hex))
+    return accumulator.area
+
+
+class RegionIndex:
+    """
+    Number of dug cells inside any rectangle, without rasterizing the lagoon.
+
+    The vertex coordinates split the plane into a compressed grid of blocks, in which
+    every cell is either dug or not. A 2-D prefix sum over the blocks answers a query
+    with a binary search per axis.
+    """
+
+    def __init__(self, vertices: np.ndarray):
+        """
+        Args:
+            vertices: The (y, x) corners of the trench loop, in order
+        """
+        vertices = np.asarray(vertices, dtype=np.int64)
+        starts, ends = vertices, np.roll(vertices, -1, axis=0)
+
+        # every vertex row / column is a block of its own, the rows / columns between
+        # two vertices form one block
+        self.ys = np.unique(np.concatenate([vertices[:, 0], vertices[:, 0] + 1]))
+        self.xs = np.unique(np.concatenate([vertices[:, 1], vertices[:, 1] + 1]))
+        heights, widths = np.diff(self.ys), np.diff(self.xs)
+        shape = len(heights) + 1, len(widths) + 1
+
+        # trench blocks, every edge covers a rectangle of blocks
+        lows, highs = np.minimum(starts, ends), np.maximum(starts, ends)
+        trench = np.zeros((shape[0] + 1, shape[1] + 1), dtype=np.int64)
+        y0, y1 = self._block(self.ys, lows[:, 0]), self._block(self.ys, highs[:, 0])
+        x0, x1 = self._block(self.xs, lows[:, 1]), self._block(self.xs, highs[:, 1])
+        np.add.at(trench, (y0, x0), 1)
+        np.add.at(trench, (y0, x1 + 1), -1)
+        np.add.at(trench, (y1 + 1, x0), -1)
+        np.add.at(trench, (y1 + 1, x1 + 1), 1)
+        trench = trench.cumsum(axis=0).cumsum(axis=1)[:-1, :-1] > 0
+
+        # interior blocks: odd number of vertical edges to the left of the block,
+        # counting the edges that span the first row of the block
+        vertical = starts[:, 1] == ends[:, 1]
+        y0 = self._block(self.ys, lows[vertical, 0])
+        y1 = self._block(self.ys, highs[vertical, 0])
+        x = self._block(self.xs, lows[vertical, 1]) + 1
+        crossings = np.zeros(shape, dtype=np.int64)
+        np.add.at(crossings, (y0, x), 1)
+        np.add.at(crossings, (y1, x), -1)
+        inside = crossings.cumsum(axis=0).cumsum(axis=1) % 2 == 1
+
+        # the last row and column are the empty blocks behind the lagoon
+        self.dug = (trench | inside).astype(np.int64)
+        self.dug[-1, :] = self.dug[:, -1] = 0
+
+        # dug cells in front of every block, in a single row / column of cells
+        heights, widths = np.append(heights, 0), np.append(widths, 0)
+        self.row_prefix = np.zeros(shape, dtype=np.int64)
+        self.row_prefix[:, 1:] = (self.dug * widths).cumsum(axis=1)[:, :-1]
+        self.col_prefix = np.zeros(shape, dtype=np.int64)
+        self.col_prefix[1:, :] = (self.dug * heights[:, None]).cumsum(axis=0)[:-1, :]
+
+        # dug cells in front of every block
+        self.prefix = np.zeros(shape, dtype=np.int64)
+        self.prefix[1:, 1:] = (
+            (self.dug * heights[:, None] * widths).cumsum(axis=0).cumsum(axis=1)
+        )[:-1, :-1]
+
+    @classmethod
+    def from_plan(cls, directions: np.ndarray, lengths: np.ndarray) -> "RegionIndex":
+        """Build the index from a dig plan, as returned by parse_bytes"""
+        return cls(np.cumsum(directions * lengths[:, None], axis=0))
+
+    @staticmethod
+    def _block(bounds: np.ndarray, values: np.ndarray) -> np.ndarray:
+        return np.searchsorted(bounds, values, side="right") - 1
+
+    def _count_before(self, y: int, x: int) -> int:
+        """Number of dug cells above row y and left of column x"""
+        y = min(max(y, self.ys[0]), self.ys[-1])
+        x = min(max(x, self.xs[0]), self.xs[-1])
+        i, j = self._block(self.ys, y), self._block(self.xs, x)
+        dy, dx = int(y - self.ys[i]), int(x - self.xs[j])
+        return (
+            int(self.prefix[i, j])
+            + dy * int(self.row_prefix[i, j])
+            + dx * int(self.col_prefix[i, j])
+            + dy * dx * int(self.dug[i, j])
+        )
+
+    def count(self, y0: int, x0: int, y1: int, x1: int) -> int:
+        """Number of dug cells in the rectangle of rows y0..y1 and columns x0..x1"""
+        y1, x1 = y1 + 1, x1 + 1
+        return (
+            self._count_before(y1, x1)
+            - self._count_before(y0, x1)
+            - self._count_before(y1, x0)
+            + self._count_before(y0, x0)
+        )
+
+    @property
+    def area(self) -> int:
+        return int(self.prefix[-1, -1])
+
+
 @pytest.fixture()
 def puzzle_input():
     return parse(Puzzle(2023, 18).input_data)
@@ -100,3 +416,78 @@ def test_part2(puzzle_input):
 
 def test_example_part2(example_input):
     assert part2(example_input) == 952408144115
+
+
+def test_bulk(example_input):
+    data = b"""
+R 6 (#70c710)
+D 5 (#0dc571)
+L 2 (#5713f0)
+D 2 (#d2c081)
+R 2 (#59c680)
+D 2 (#411b91)
+L 5 (#8ceee2)
+U 2 (#caa173)
+L 1 (#1b58a2)
+U 2 (#caa171)
+R 2 (#7807d2)
+U 3 (#a77fa3)
+L 2 (#015232)
+U 2 (#7a21e3)
+"""
+    assert calc_area_bulk(*parse_bytes(data)) == part1(example_input)
+    assert calc_area_bulk(*parse_bytes(data, use_hex=True)) == part2(example_input)
+    square = b"R 10 (#000000)\nD 10 (#000000)\nL 10 (#000000)\nU 10 (#000000)"
+    assert calc_area_bulk(*parse_bytes(square)) == 121
+
+
+def test_bulk_overflow():
+    # a huge square, with every side split into many instructions, so that the
+    # shoelace sum could overflow int64
+    pieces, piece_length = 1000, 2**30
+    directions = np.repeat([(0, 1), (1, 0), (0, -1), (-1, 0)], pieces, axis=0)
+    lengths = np.full(len(directions), piece_length, dtype=np.int64)
+    assert calc_area_bulk(directions, lengths) == (pieces * piece_length + 1) ** 2
+
+
+def test_streaming(example_input, tmp_path):
+    lines = [f"{d} {n} (#{h})" for d, n, h in example_input]
+    assert area_from_lines(iter(lines)) == 62
+    assert area_from_lines(iter(lines), use_hex=True) == 952408144115
+
+    path = tmp_path / "plan.txt"
+    path.write_text("\n".join(lines))
+    for chunk_size in (1, 10, 1 << 20):
+        assert area_from_file(path, chunk_size=chunk_size) == 62
+        assert area_from_file(path, True, chunk_size=chunk_size) == 952408144115
+
+
+def test_region_index(example_input):
+    lagoon = [
+        "#######",
+        "#######",
+        "#######",
+        "..#####",
+        "..#####",
+        "#######",
+        "#####..",
+        "#######",
+        ".######",
+        ".######",
+    ]
+    data = "\n".join(f"{d} {n} (#{h})" for d, n, h in example_input).encode()
+    index = RegionIndex.from_plan(*parse_bytes(data))
+    assert index.area == 62
+    assert index.count(-5, -5, 20, 20) == 62
+
+    for y0 in range(len(lagoon)):
+        for y1 in range(y0, len(lagoon)):
+            for x0 in range(len(lagoon[0])):
+                for x1 in range(x0, len(lagoon[0])):
+                    expected = sum(
+                        row[x0 : x1 + 1].count("#") for row in lagoon[y0 : y1 + 1]
+                    )
+                    assert index.count(y0, x0, y1, x1) == expected
+
+    index = RegionIndex.from_plan(*parse_bytes(data, use_hex=True))
+    assert index.area == 952408144115
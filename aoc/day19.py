@@ -1,6 +1,10 @@
 from attr import dataclass
+from collections import Counter
+from collections.abc import Callable
 import pytest
+import numpy as np
 from aocd.models import Puzzle
+from itertools import product
 from math import prod
 
 
@@ -81,7 +85,12 @@ def parse_parts(parts_data: str) -> list[Part]:
 
 
 def part1(workflows: dict[str, Workflow], parts: list[Part]) -> int:
-    return sum(part.sum() for part in parts if is_accepted(workflows, part))
+    try:
+        classify = compile_workflows(workflows)
+    except (SyntaxError, RecursionError, MemoryError):  # fall back to interpreting
+        return sum(part.sum() for part in parts if is_accepted(workflows, part))
+
+    return sum(part.sum() for part in parts if classify(part.x, part.m, part.a, part.s))
 
 
 def is_accepted(workflows: dict[str, Workflow], part: Part) -> bool:
@@ -107,6 +116,150 @@ def compute_workflow(workflow: Workflow, part: Part) -> str:
     return workflow.fallback_workflow
 
 
+# deepest nesting of inlined workflows, before continuing in a new function
+MAX_INLINE_DEPTH = 32
+
+
+def workflow_source(workflows: dict[str, Workflow], name: str = "classify") -> str:
+    """
+    Generate the python source of a function, which takes the x, m, a and s values of
+    a part and returns whether it is accepted.
+
+    Workflows are inlined into nested if/elif/else blocks of the workflow that sends
+    parts to them, with one level of nesting per workflow. Workflows that are sent to
+    by more than one rule, or that would be nested too deep, are generated as a
+    function of their own and called instead. So every workflow is generated once.
+    """
+    return _SourceWriter(workflows).write(name)
+
+
+class _SourceWriter:
+    def __init__(self, workflows: dict[str, Workflow]):
+        self.workflows = workflows
+        self.references = Counter(
+            target
+            for workflow in workflows.values()
+            for target in [rule.next_workflow for rule in workflow.rules]
+            + [workflow.fallback_workflow]
+        )
+        self.lines: list[str] = []
+        self.pending = ["in"]  # workflows that need a function of their own
+        self.functions = {"in"}
+
+    def write(self, name: str) -> str:
+        while self.pending:
+            workflow = self.pending.pop()
+            self.lines.append(f"def {_function_name(workflow)}(x, m, a, s):")
+            self._inline(workflow, 1)
+            self.lines.append("")
+
+        self.lines.append(f"{name} = {_function_name('in')}")
+        return "\n".join(self.lines) + "\n"
+
+    def _send(self, workflow: str, depth: int):
+        """Generate the code that sends a part to the given workflow"""
+        indent = "    " * depth
+        if workflow in ("A", "R"):
+            self.lines.append(f"{indent}return {workflow == 'A'}")
+        elif (
+            workflow in self.functions
+            or self.references[workflow] > 1
+            or depth > MAX_INLINE_DEPTH
+        ):
+            if workflow not in self.functions:
+                self.functions.add(workflow)
+                self.pending.append(workflow)
+            self.lines.append(f"{indent}return {_function_name(workflow)}(x, m, a, s)")
+        else:
+            self._inline(workflow, depth)
+
+    def _inline(self, workflow: str, depth: int):
+        indent = "    " * depth
+        self.lines.append(f"{indent}# {workflow}")
+        rules = self.workflows[workflow].rules
+        for i, rule in enumerate(rules):
+            keyword = "if" if i == 0 else "elif"
+            comparison = rule.comparison
+            self.lines.append(
+                f"{indent}{keyword} {comparison.prop} {comparison.op} "
+                f"{comparison.value}:"
+            )
+            self._send(rule.next_workflow, depth + 1)
+
+        if rules:
+            self.lines.append(f"{indent}else:")
+            depth += 1
+        self._send(self.workflows[workflow].fallback_workflow, depth)
+
+
+def _function_name(workflow: str) -> str:
+    return f"workflow_{workflow}"
+
+
+def compile_workflows(
+    workflows: dict[str, Workflow],
+) -> Callable[[int, int, int, int], bool]:
+    """
+    Compile the workflows into a python function, see workflow_source.
+
+    Compiling is not cached, the caller should keep the returned function for as long
+    as the workflows stay the same.
+    """
+    namespace = {}
+    code = compile(workflow_source(workflows), "<workflows>", "exec")
+    # the executed source is generated from parsed workflows, not taken from the input
+    exec(code, namespace)  # noqa: S102
+    return namespace["classify"]
+
+
+def part_columns(parts: list[Part]) -> dict[str, np.ndarray]:
+    """Store the parts column-wise, as one int array per property"""
+    return {
+        prop: np.fromiter((getattr(part, prop) for part in parts), np.int64, len(parts))
+        for prop in "xmas"
+    }
+
+
+def accepted_mask(
+    workflows: dict[str, Workflow], columns: dict[str, np.ndarray]
+) -> np.ndarray:
+    """
+    Run all parts through the workflows at once.
+
+    Instead of following every part on its own, the indices of all parts in the same
+    workflow are kept together and split by every rule with a boolean mask.
+    """
+    accepted = np.zeros(len(columns["x"]), dtype=bool)
+    pending = [("in", np.arange(len(accepted)))]
+    while pending:
+        workflow, indices = pending.pop()
+        if workflow == "A":
+            accepted[indices] = True
+            continue
+        if workflow == "R":
+            continue
+
+        for rule in workflows[workflow].rules:
+            values = columns[rule.comparison.prop][indices]
+            matches = OPS[rule.comparison.op](values, rule.comparison.value)
+            if matches.any():
+                pending.append((rule.next_workflow, indices[matches]))
+                indices = indices[~matches]
+            if len(indices) == 0:
+                break
+        else:
+            pending.append((workflows[workflow].fallback_workflow, indices))
+
+    return accepted
+
+
+def part1_columnar(
+    workflows: dict[str, Workflow], columns: dict[str, np.ndarray]
+) -> int:
+    accepted = accepted_mask(workflows, columns)
+    return int(sum(column[accepted].sum() for column in columns.values()))
+
+
 def part2(workflows: dict[str, Workflow], maximum: int = 4000) -> int:
     ranges = {prop: range(1, maximum + 1) for prop in "xmas"}
 
@@ -114,7 +267,10 @@ def part2(workflows: dict[str, Workflow], maximum: int = 4000) -> int:
 
 
 def compute_accepted_for_ranges(
-    ranges: dict[str, range], workflow: str, workflows: dict[str, Workflow]
+    ranges: dict[str, range],
+    workflow: str,
+    workflows: dict[str, Workflow],
+    boxes: list[dict[str, range]] | None = None,
 ) -> int:
     """
     Compute how many parts are accepted for the given ranges of part properties
@@ -129,8 +285,13 @@ def compute_accepted_for_ranges(
 
     If the workflow is "A" or "R", we are done and return the number of accepted parts,
     which is just the product of the lengths of the ranges for all properties.
+
+    The accepted ranges are disjoint boxes in xmas space, if a boxes list is given,
+    they are appended to it.
     """
     if workflow == "A":
+        if boxes is not None:
+            boxes.append(dict(ranges))
         return prod(len(r) for r in ranges.values())
 
     if workflow == "R":
@@ -147,6 +308,7 @@ def compute_accepted_for_ranges(
                 {**ranges, rule.comparison.prop: true_branch},
                 rule.next_workflow,
                 workflows,
+                boxes,
             )
         if not false_branch:  # empty range, so no more parts can be accepted here
             return accepted
@@ -156,12 +318,263 @@ def compute_accepted_for_ranges(
 
     # continue with the fallback workflow
     accepted += compute_accepted_for_ranges(
-        ranges, workflows[workflow].fallback_workflow, workflows
+        ranges, workflows[workflow].fallback_workflow, workflows, boxes
     )
 
     return accepted
 
 
+@dataclass
+class _BoxNode:
+    volume: int
+    axis: int = -1  # -1 for leaves
+    split: int = 0
+    left: "_BoxNode | None" = None  # values below split
+    right: "_BoxNode | None" = None  # values from split on
+    lows: np.ndarray | None = None  # boxes of leaves
+    highs: np.ndarray | None = None
+
+
+class AcceptedBoxIndex:
+    """
+    k-d tree over the disjoint accepted boxes of compute_accepted_for_ranges.
+
+    Every node splits its part of xmas space at one value of one property, boxes
+    crossing the split are clipped into both children. Looking up a part follows a
+    single path, counting accepted parts in a box only descends into the nodes that
+    are partially covered by it.
+    """
+
+    def __init__(
+        self, boxes: list[dict[str, range]], maximum: int = 4000, leaf_size: int = 8
+    ):
+        lows = np.array([[box[prop].start for prop in "xmas"] for box in boxes])
+        highs = np.array([[box[prop].stop for prop in "xmas"] for box in boxes])
+        self.low = np.ones(4, dtype=np.int64)
+        self.high = np.full(4, maximum + 1, dtype=np.int64)
+        self.leaf_size = leaf_size
+        self.root = self._build(
+            lows.reshape(-1, 4).astype(np.int64),
+            highs.reshape(-1, 4).astype(np.int64),
+            self.low,
+            self.high,
+        )
+
+    @classmethod
+    def from_workflows(
+        cls, workflows: dict[str, Workflow], maximum: int = 4000
+    ) -> "AcceptedBoxIndex":
+        boxes = []
+        ranges = {prop: range(1, maximum + 1) for prop in "xmas"}
+        compute_accepted_for_ranges(ranges, "in", workflows, boxes)
+        return cls(boxes, maximum)
+
+    def _build(
+        self, lows: np.ndarray, highs: np.ndarray, low: np.ndarray, high: np.ndarray
+    ) -> _BoxNode:
+        volume = int(np.prod(highs - lows, axis=1).sum())
+
+        # split along the property with the most box boundaries inside the node
+        axis, bounds = -1, np.empty(0, dtype=np.int64)
+        if len(lows) > self.leaf_size:
+            for candidate in range(4):
+                values = np.unique(
+                    np.concatenate([lows[:, candidate], highs[:, candidate]])
+                )
+                values = values[(values > low[candidate]) & (values < high[candidate])]
+                if len(values) > len(bounds):
+                    axis, bounds = candidate, values
+        if axis == -1:
+            return _BoxNode(volume, lows=lows, highs=highs)
+
+        split = bounds[len(bounds) // 2]
+        below, above = lows[:, axis] < split, highs[:, axis] > split
+        below_highs, above_lows = highs[below].copy(), lows[above].copy()
+        np.minimum(below_highs[:, axis], split, out=below_highs[:, axis])
+        np.maximum(above_lows[:, axis], split, out=above_lows[:, axis])
+        below_high, above_low = high.copy(), low.copy()
+        below_high[axis] = above_low[axis] = split
+
+        return _BoxNode(
+            volume,
+            axis,
+            int(split),
+            self._build(lows[below], below_highs, low, below_high),
+            self._build(above_lows, highs[above], above_low, high),
+        )
+
+    @property
+    def volume(self) -> int:
+        return self.root.volume
+
+    def is_accepted(self, part: Part) -> bool:
+        point = np.array([part.x, part.m, part.a, part.s])
+        node = self.root
+        while node.axis != -1:
+            node = node.left if point[node.axis] < node.split else node.right
+
+        inside = (node.lows <= point) & (point < node.highs)
+        return bool(inside.all(axis=1).any())
+
+    def count(self, ranges: dict[str, range]) -> int:
+        """Number of accepted parts with all properties in the given ranges"""
+        query_low = np.array([ranges[prop].start for prop in "xmas"])
+        query_high = np.array([ranges[prop].stop for prop in "xmas"])
+        return self._count(self.root, query_low, query_high, self.low, self.high)
+
+    def _count(
+        self,
+        node: _BoxNode,
+        query_low: np.ndarray,
+        query_high: np.ndarray,
+        low: np.ndarray,
+        high: np.ndarray,
+    ) -> int:
+        clipped_low, clipped_high = (
+            np.maximum(query_low, low),
+            np.minimum(query_high, high),
+        )
+        if (clipped_low >= clipped_high).any():
+            return 0
+        if (clipped_low == low).all() and (clipped_high == high).all():
+            return node.volume
+
+        if node.axis == -1:
+            sizes = np.minimum(node.highs, query_high) - np.maximum(
+                node.lows, query_low
+            )
+            return int(np.prod(np.maximum(sizes, 0), axis=1).sum())
+
+        below_high, above_low = high.copy(), low.copy()
+        below_high[node.axis] = above_low[node.axis] = node.split
+        return self._count(
+            node.left, query_low, query_high, low, below_high
+        ) + self._count(node.right, query_low, query_high, above_low, high)
+
+
+Box = tuple[tuple[int, int], ...]  # (start, stop) for x, m, a and s
+
+
+class AcceptedVolumeEvaluator:
+    """
+    compute_accepted_for_ranges with a cache of the accepted volume per workflow and
+    input box, for recounting after editing single workflows.
+
+    The volume of a workflow for a box only depends on the workflows reachable from
+    it, so an edit only invalidates the cache of the edited workflow and of the
+    workflows that lead to it. Their unchanged children are looked up in the cache,
+    as long as they are reached with the same boxes.
+
+    Every cache entry keeps the entries of its children referenced. Entries that are
+    no longer referenced after a recount, because the edited rules reach them with
+    different boxes now, are dropped again.
+    """
+
+    def __init__(self, workflows: dict[str, Workflow], maximum: int = 4000):
+        self.workflows = dict(workflows)
+        self.maximum = maximum
+        self.cache: dict[str, dict[Box, int]] = {}
+        self.parents: dict[str, set[str]] = {}
+        for workflow in self.workflows.values():
+            for target in _targets(workflow):
+                self.parents.setdefault(target, set()).add(workflow.name)
+        # cache entries used by every cache entry, and how often each is used
+        self.children: dict[tuple[str, Box], list[tuple[str, Box]]] = {}
+        self.references: dict[tuple[str, Box], int] = {}
+        self._unreferenced: list[tuple[str, Box]] = []
+        self.evaluations = 0  # number of workflows evaluated, without the cache
+
+    def count(self) -> int:
+        accepted = self._accepted("in", ((1, self.maximum + 1),) * 4)
+        self._drop_unreferenced()
+        return accepted
+
+    def _accepted(self, workflow: str, box: Box) -> int:
+        if workflow == "A":
+            return prod(stop - start for start, stop in box)
+        if workflow == "R":
+            return 0
+
+        cache = self.cache.setdefault(workflow, {})
+        if box in cache:
+            return cache[box]
+
+        self.evaluations += 1
+        ranges = {prop: range(*bounds) for prop, bounds in zip("xmas", box)}
+        accepted = 0
+        children = []
+        for rule in self.workflows[workflow].rules:
+            true_branch, false_branch = split_range(
+                ranges[rule.comparison.prop], rule.comparison.op, rule.comparison.value
+            )
+            if true_branch:
+                true_ranges = {**ranges, rule.comparison.prop: true_branch}
+                children.append((rule.next_workflow, _box(true_ranges)))
+            if not false_branch:
+                break
+            ranges[rule.comparison.prop] = false_branch
+        else:
+            children.append((self.workflows[workflow].fallback_workflow, _box(ranges)))
+
+        for child in children:
+            accepted += self._accepted(*child)
+            if child[0] not in ("A", "R"):
+                self.references[child] = self.references.get(child, 0) + 1
+        self.children[workflow, box] = children
+
+        cache[box] = accepted
+        return accepted
+
+    def _release(self, key: tuple[str, Box]):
+        """Remove the references of a dropped cache entry to its children"""
+        for child in self.children.pop(key, ()):
+            if child in self.references:
+                self.references[child] -= 1
+                if self.references[child] == 0:
+                    self._unreferenced.append(child)
+
+    def _drop_unreferenced(self):
+        while self._unreferenced:
+            key = self._unreferenced.pop()
+            if self.references.get(key, 0) > 0:  # used again by the recount
+                continue
+            self.references.pop(key, None)
+            workflow, box = key
+            if self.cache.get(workflow, {}).pop(box, None) is not None:
+                self._release(key)
+
+    def set_workflow(self, workflow: Workflow):
+        """Replace (or add) a workflow, invalidating it and all of its ancestors"""
+        invalid, pending = set(), [workflow.name]
+        while pending:
+            name = pending.pop()
+            if name not in invalid:
+                invalid.add(name)
+                for box in self.cache.pop(name, {}):
+                    # all entries referencing this one are invalidated as well
+                    self.references.pop((name, box), None)
+                    self._release((name, box))
+                pending.extend(self.parents.get(name, ()))
+
+        if workflow.name in self.workflows:
+            for target in _targets(self.workflows[workflow.name]):
+                self.parents[target].discard(workflow.name)
+        for target in _targets(workflow):
+            self.parents.setdefault(target, set()).add(workflow.name)
+        self.workflows[workflow.name] = workflow
+
+
+def _targets(workflow: Workflow) -> set[str]:
+    """Workflows a workflow can send parts to, without A and R"""
+    targets = {rule.next_workflow for rule in workflow.rules}
+    targets.add(workflow.fallback_workflow)
+    return targets - {"A", "R"}
+
+
+def _box(ranges: dict[str, range]) -> Box:
+    return tuple((ranges[prop].start, ranges[prop].stop) for prop in "xmas")
+
+
 def split_range(r: range, op: str, value: int) -> tuple[range, range]:
     """
     Split a range into two ranges, a true and a false range.
@@ -234,3 +647,103 @@ def test_split_range():
     assert split_range(range(5, 10), ">", 5) == (range(6, 10), range(5, 6))
     assert split_range(range(5, 10), ">", 4) == (range(5, 10), range(5, 5))
     assert split_range(range(5, 10), ">", 10) == (range(10, 10), range(5, 10))
+
+
+def test_compile_workflows(example_input):
+    workflows, parts = example_input
+    source = workflow_source(workflows)
+    assert source.startswith("def workflow_in(x, m, a, s):\n    # in\n    if s < 1351:")
+    assert source.endswith("classify = workflow_in\n")
+
+    classify = compile_workflows(workflows)
+    for part in parts:
+        assert classify(part.x, part.m, part.a, part.s) == is_accepted(workflows, part)
+    for values in product([1, 838, 839, 1415, 1416, 2090, 2091, 3448, 3449], repeat=4):
+        part = Part(*values)
+        assert classify(*values) == is_accepted(workflows, part)
+
+
+def test_compile_deep_workflows():
+    # a long chain, which is too deep to nest in a single function
+    chain = [f"c{i}{{x>{i}:c{i + 1},R}}" for i in range(200)] + ["c200{m<10:A,R}"]
+    workflows = parse_workflows("\n".join(["in{a<5:R,c0}", *chain]))
+    classify = compile_workflows(workflows)
+    for values in product([1, 9, 100, 201], repeat=4):
+        assert classify(*values) == is_accepted(workflows, Part(*values))
+
+    # every workflow is sent to from two rules, so inlining would double the source
+    # with every level
+    lines = [f"d{i}{{x<{i + 10}:d{i + 1},m>{i}:d{i + 1},A}}" for i in range(40)]
+    workflows = parse_workflows("\n".join(["in{s>1:d0,R}", *lines, "d40{a>5:A,R}"]))
+    assert len(workflow_source(workflows).splitlines()) < 10 * len(workflows)
+    classify = compile_workflows(workflows)
+    for values in product([1, 9, 25, 50], repeat=4):
+        assert classify(*values) == is_accepted(workflows, Part(*values))
+
+
+def test_accepted_mask(example_input):
+    workflows, parts = example_input
+    columns = part_columns(parts)
+    assert accepted_mask(workflows, columns).tolist() == [
+        True,
+        False,
+        True,
+        False,
+        True,
+    ]
+    assert part1_columnar(workflows, columns) == 19114
+
+    values = np.array(list(product([1, 838, 839, 1415, 1416, 2090, 3449], repeat=4)))
+    columns = dict(zip("xmas", values.T))
+    mask = accepted_mask(workflows, columns)
+    assert mask.tolist() == [is_accepted(workflows, Part(*row)) for row in values]
+
+
+def test_accepted_box_index(example_input):
+    workflows, _ = example_input
+    boxes = []
+    ranges = {prop: range(1, 4001) for prop in "xmas"}
+    assert compute_accepted_for_ranges(ranges, "in", workflows, boxes) == sum(
+        prod(len(r) for r in box.values()) for box in boxes
+    )
+
+    index = AcceptedBoxIndex(boxes)
+    assert index.volume == 167409079868000
+    for values in product([1, 838, 839, 1415, 1416, 2090, 3449, 4000], repeat=4):
+        part = Part(*values)
+        assert index.is_accepted(part) == is_accepted(workflows, part)
+
+    for bounds in [
+        [(1, 4001), (1, 4001), (1, 4001), (1, 4001)],
+        [(1, 2), (1, 2), (1, 2), (1, 2)],
+        [(100, 3000), (800, 900), (1, 4001), (500, 3500)],
+        [(1400, 1420), (2000, 2100), (1700, 3400), (1300, 1400)],
+    ]:
+        sub_ranges = {prop: range(*bound) for prop, bound in zip("xmas", bounds)}
+        expected = compute_accepted_for_ranges(dict(sub_ranges), "in", workflows)
+        assert index.count(sub_ranges) == expected
+
+
+def test_accepted_volume_evaluator(example_input):
+    workflows, _ = example_input
+    evaluator = AcceptedVolumeEvaluator(workflows)
+    assert evaluator.count() == 167409079868000
+    assert evaluator.evaluations == len(workflows)
+
+    # crn is only reached from in -> px -> qkq
+    edited = Workflow.parse("crn{x>2000:A,R}")
+    evaluator.evaluations = 0
+    evaluator.set_workflow(edited)
+    assert evaluator.count() == part2({**workflows, "crn": edited})
+    assert evaluator.evaluations == 4
+
+    # px now sends all parts to rfg, so qkq and crn are no longer reached
+    evaluator.set_workflow(Workflow.parse("px{a<2006:rfg,m>2090:A,rfg}"))
+    workflows = {**workflows, "crn": edited, "px": evaluator.workflows["px"]}
+    assert evaluator.count() == part2(workflows)
+
+    fresh = AcceptedVolumeEvaluator(workflows)
+    fresh.count()
+    assert {name: boxes for name, boxes in evaluator.cache.items() if boxes} == {
+        name: boxes for name, boxes in fresh.cache.items() if boxes
+    }